@@ -20,49 +20,147 @@ try:
 except NameError:
     from sets import Set as set
 
-import sqlalchemy
-from sqlalchemy.types import *
-
-from elixir.options import using_options, using_table_options, \
-                           using_mapper_options, options_defaults, \
-                           using_options_defaults
-from elixir.entity import Entity, EntityBase, EntityMeta, EntityDescriptor, \
-                          setup_entities, cleanup_entities
-from elixir.fields import has_field, Field
-from elixir.relationships import belongs_to, has_one, has_many, \
-                                 has_and_belongs_to_many, \
-                                 ManyToOne, OneToOne, OneToMany, ManyToMany
-from elixir.properties import has_property, GenericProperty, ColumnProperty, \
-                              Synonym
-from elixir.statements import Statement
+import sys
+import threading
+from types import ModuleType
+
 from elixir.collection import EntityCollection, GlobalEntityCollection
+from elixir import profiling
+from elixir.profiling import setup_report
 
 
 __version__ = '0.8.0dev'
 
-__all__ = ['Entity', 'EntityBase', 'EntityMeta', 'EntityCollection',
-           'entities',
-           'Field', 'has_field',
-           'has_property', 'GenericProperty', 'ColumnProperty', 'Synonym',
-           'belongs_to', 'has_one', 'has_many', 'has_and_belongs_to_many',
-           'ManyToOne', 'OneToOne', 'OneToMany', 'ManyToMany',
-           'using_options', 'using_table_options', 'using_mapper_options',
-           'options_defaults', 'using_options_defaults',
-           'metadata', 'session',
-           'create_all', 'drop_all',
-           'setup_all', 'cleanup_all',
-           'setup_entities', 'cleanup_entities'] + \
-           sqlalchemy.types.__all__
+# the names of the public API which are defined in other modules, which are
+# only imported when one of those names is first accessed (see LazyModule)
+lazy_names = {
+    'elixir.options': ['using_options', 'using_table_options',
+                       'using_mapper_options', 'options_defaults',
+                       'using_options_defaults'],
+    'elixir.entity': ['Entity', 'EntityBase', 'EntityMeta',
+                      'EntityDescriptor', 'setup_entities',
+                      'lazy_setup_entities', 'incremental_setup_entities',
+                      'cleanup_entities', 'resolve_targets',
+                      'freeze_entities', 'setup_registry'],
+    'elixir.fields': ['has_field', 'Field'],
+    'elixir.relationships': ['belongs_to', 'has_one', 'has_many',
+                             'has_and_belongs_to_many', 'ManyToOne',
+                             'OneToOne', 'OneToMany', 'ManyToMany'],
+    'elixir.properties': ['has_property', 'GenericProperty',
+                          'ColumnProperty', 'Synonym'],
+    'elixir.statements': ['Statement'],
+}
+
+lazy_modules = {}
+for module_name, names in lazy_names.iteritems():
+    for name in names:
+        lazy_modules[name] = module_name
+del module_name, names, name
+
+elixir_all = ['Entity', 'EntityBase', 'EntityMeta', 'EntityCollection',
+              'entities',
+              'Field', 'has_field',
+              'has_property', 'GenericProperty', 'ColumnProperty', 'Synonym',
+              'belongs_to', 'has_one', 'has_many', 'has_and_belongs_to_many',
+              'ManyToOne', 'OneToOne', 'OneToMany', 'ManyToMany',
+              'using_options', 'using_table_options', 'using_mapper_options',
+              'options_defaults', 'using_options_defaults',
+              'metadata', 'session',
+              'create_all', 'drop_all',
+              'setup_all', 'cleanup_all', 'setup_report', 'freeze',
+              'setup_entities', 'lazy_setup_entities',
+              'incremental_setup_entities', 'cleanup_entities',
+              'freeze_entities']
 
 __doc_all__ = ['create_all', 'drop_all',
-               'setup_all', 'cleanup_all',
+               'setup_all', 'cleanup_all', 'setup_report', 'freeze',
                'metadata', 'session']
 
-# default session
-session = sqlalchemy.orm.scoped_session(sqlalchemy.orm.sessionmaker())
 
-# default metadata
-metadata = sqlalchemy.MetaData()
+def create_session():
+    import sqlalchemy.orm
+    return sqlalchemy.orm.scoped_session(sqlalchemy.orm.sessionmaker())
+
+
+def create_metadata():
+    import sqlalchemy
+    return sqlalchemy.MetaData()
+
+
+def get_all():
+    # all the types of SQLAlchemy are exported too
+    import sqlalchemy.types
+    return elixir_all + sqlalchemy.types.__all__
+
+
+def get_sqlalchemy():
+    import sqlalchemy
+    return sqlalchemy
+
+
+# the values created when they are first accessed: the default session, the
+# default metadata and the names exported by "from elixir import *"
+lazy_values = {
+    'session': create_session,
+    'metadata': create_metadata,
+    '__all__': get_all,
+    'sqlalchemy': get_sqlalchemy,
+}
+
+
+class LazyModule(ModuleType):
+    '''
+    Replaces the elixir module in sys.modules, so that the modules defining
+    the public names (and SQLAlchemy itself) are only imported, and the
+    default session and metadata only created, when they are first accessed.
+
+    The functions defined in the original module still look up names in its
+    dictionary, so the attributes set on this module are set on the original
+    module too.
+    '''
+
+    def __init__(self, module):
+        ModuleType.__init__(self, module.__name__, module.__doc__)
+        self.__dict__.update(module.__dict__)
+        # the globals of a module are cleared when it is deallocated
+        self.__dict__['_original'] = module
+        self.__dict__['_lock'] = threading.RLock()
+
+    def __getattr__(self, name):
+        if name in lazy_modules:
+            def load():
+                module = __import__(lazy_modules[name], {}, {}, [name])
+                return getattr(module, name)
+        elif name in lazy_values:
+            load = lazy_values[name]
+        elif name[:1].isupper() or name == 'type_map':
+            # the types of SQLAlchemy, whose names are capitalized (unlike
+            # those of the submodules of elixir, which are imported when
+            # this fails)
+            import sqlalchemy.types
+            if name not in sqlalchemy.types.__all__:
+                raise AttributeError(name)
+            def load():
+                return getattr(sqlalchemy.types, name)
+        else:
+            raise AttributeError(name)
+        self._lock.acquire()
+        try:
+            # another thread may have loaded it while we were waiting
+            if name not in self.__dict__:
+                setattr(self, name, load())
+            return self.__dict__[name]
+        finally:
+            self._lock.release()
+
+    def __setattr__(self, name, value):
+        ModuleType.__setattr__(self, name, value)
+        setattr(self._original, name, value)
+
+    def __delattr__(self, name):
+        ModuleType.__delattr__(self, name)
+        self._original.__dict__.pop(name, None)
+
 
 metadatas = set()
 
@@ -78,31 +176,142 @@ def create_all(*args, **kwargs):
 
 def drop_all(*args, **kwargs):
     '''Drop tables for all declared entities'''
+    from elixir.entity import setup_registry
+
     for md in metadatas:
         md.drop_all(*args, **kwargs)
+    # the changes waiting for an incremental setup are forgotten too
+    setup_registry.clear()
 
 
 def setup_all(create_tables=False, *args, **kwargs):
     '''Setup the table and mapper of all entities in the default entity
     collection.
+
+    If the `lazy` keyword argument is True, entities are not set up right
+    away, but only when they are first used (see `lazy_setup_entities`).
+    This cannot be combined with `create_tables`.
+
+    If the `reflect` keyword argument is True, the tables of all autoloaded
+    entities are reflected up front, using one connection per metadata and
+    schema. If it is an integer, they are reflected concurrently using that
+    number of threads (see the `elixir.reflection` module).
+
+    The `reflection_cache` keyword argument can be given either the path of a
+    file or a `ReflectionCache` instance. The tables of autoloaded entities
+    are then loaded from that cache as long as the database schema does not
+    change (see the `elixir.reflection` module).
+
+    If the `incremental` keyword argument is True, only the entities declared
+    since the last setup, and the properties added to entities which were
+    already set up, are processed (see `incremental_setup_entities`).
+
+    If the `schedule` keyword argument is True, the entities are set up one
+    dependency component at a time, in topological order, instead of phase
+    after phase for all entities. If it is an integer, the tables of
+    autoloaded entities are first reflected concurrently using that number of
+    threads (see the `elixir.scheduler` module).
+
+    If the `freeze` keyword argument is True, the state which is only needed
+    during setup is released once all entities are set up (see `freeze`).
+
+    If the `profile` keyword argument is True, the time spent in each setup
+    phase of each entity and in each builder is recorded. The results can be
+    retrieved with `setup_report` (see the `elixir.profiling` module). If it
+    is 'allocations', the objects allocated are counted even on interpreters
+    which cannot report it cheaply.
     '''
-    setup_entities(entities)
+    from elixir.entity import setup_entities, lazy_setup_entities, \
+                              incremental_setup_entities, resolve_targets
+
+    lazy = kwargs.pop('lazy', False)
+    reflect = kwargs.pop('reflect', False)
+    reflection_cache = kwargs.pop('reflection_cache', None)
+    profile = kwargs.pop('profile', False)
+    incremental = kwargs.pop('incremental', False)
+    schedule = kwargs.pop('schedule', False)
+    freeze_state = kwargs.pop('freeze', False)
+    if lazy and create_tables:
+        raise Exception("Tables cannot be created when entities are set up "
+                        "lazily.")
+
+    # import the modules defining the targets of relationships which were
+    # not imported yet, so that their entities are part of the setup. When
+    # entities are set up lazily, the targets of each entity are only
+    # resolved (and their modules imported) when it is set up.
+    if not lazy:
+        resolve_targets(entities)
+
+    # the modules implementing the optional features of setup_all are only
+    # imported when those features are used, to keep "import elixir" cheap.
+    if reflect is True:
+        threads = None
+    else:
+        threads = reflect
+    if reflection_cache is not None:
+        if isinstance(reflection_cache, basestring):
+            from elixir.reflection import ReflectionCache
+            reflection_cache = ReflectionCache(reflection_cache)
+        reflection_cache.reflect_autoloaded_tables(entities, threads=threads)
+    elif reflect:
+        from elixir.reflection import reflect_autoloaded_tables
+        reflect_autoloaded_tables(entities, threads=threads)
+
+    if profile:
+        profiling.start(count_objects=profile == 'allocations')
+    try:
+        if lazy:
+            lazy_setup_entities(entities)
+        elif incremental:
+            incremental_setup_entities(entities)
+        elif schedule:
+            from elixir import scheduler
+            scheduler.last_scheduler = scheduler.SetupScheduler(entities)
+            if schedule is True:
+                scheduler.last_scheduler.run()
+            else:
+                scheduler.last_scheduler.run(threads=schedule)
+        else:
+            setup_entities(entities)
+    finally:
+        if profile:
+            profiling.stop()
+
+    if freeze_state:
+        freeze()
 
     # issue the "CREATE" SQL statements
     if create_tables:
         create_all(*args, **kwargs)
 
 
+def freeze():
+    '''Release the state which is only needed during setup (builders,
+    properties, relationships, ...) for all entities of the default entity
+    collection which are set up. This should only be called once the model is
+    complete. Returns a dictionary of the approximate number of bytes
+    released for each entity, keyed on the entity name.
+    '''
+    from elixir.entity import freeze_entities
+
+    return freeze_entities(entities)
+
+
 def cleanup_all(drop_tables=False, *args, **kwargs):
     '''Clear all mappers, clear the session, and clear all metadatas.
     Optionally drops the tables.
     '''
-    session.close()
+    import sqlalchemy.orm
+    import elixir
+    from elixir.entity import cleanup_entities, setup_registry
+
+    elixir.session.close()
 
     cleanup_entities(entities)
 
     sqlalchemy.orm.clear_mappers()
     entities.clear()
+    setup_registry.reset()
 
     if drop_tables:
         drop_all(*args, **kwargs)
@@ -112,3 +321,4 @@ def cleanup_all(drop_tables=False, *args, **kwargs):
     metadatas.clear()
 
 
+sys.modules[__name__] = LazyModule(sys.modules[__name__])
@@ -0,0 +1,486 @@
+'''
+Result caches for the `get_by` and `get` class methods of entities.
+
+Lookups by a unique attribute (a slug, an email address, a code, ...) are
+usually done with `get_by`, which runs a new query each time. When the
+``query_cache`` option of an entity is set, the primary key of the instance
+returned by `get_by` is cached, keyed on the criteria given, so that later
+calls with the same criteria only need to get the instance by primary key,
+which does not query the database at all when the instance is already in the
+session.
+
+.. sourcecode:: python
+
+    class User(Entity):
+        email = Field(String(100), unique=True)
+        using_options(query_cache=True)
+
+    User.get_by(email='bob@example.com')    # runs a query
+    User.get_by(email='bob@example.com')    # taken from the cache
+
+    print User._descriptor.query_cache.stats()
+
+The ``query_cache`` option can be given as True (to use a cache with the
+default size and no expiration), as the maximum number of entries of the
+cache, as a dictionary of keyword arguments for `QueryCache` (``size`` and
+``ttl``, the number of seconds after which entries expire) or as a
+`QueryCache` instance.
+
+Entities which are read much more often than they are written (lookup tables
+of countries or currencies, hot rows, ...) can also use the ``pk_cache``
+option, which takes the same values. The column values of the instances
+returned by `get` are then cached, keyed on their primary key, in a cache
+shared by all sessions (and threads). When an instance is not present in the
+session `get` is called on, it is rebuilt from the cached values and merged
+into that session without querying the database. Its relationships are
+loaded as usual when accessed. `get_by` takes advantage of that cache too
+when both options are used.
+
+.. sourcecode:: python
+
+    class Country(Entity):
+        code = Field(String(2), unique=True)
+        name = Field(Unicode(100))
+        using_options(pk_cache={'size': 500, 'ttl': 3600})
+
+The least recently used entries are evicted when the cache is full. Entries
+are invalidated when an instance of the entity is inserted, updated or
+deleted through its mapper (that is, when the session is flushed, and for the
+``pk_cache`` option, again when it is committed or rolled back), but not when
+the database is modified by other means (including other processes): use the
+``ttl`` argument to bound how long such changes can go unnoticed.
+'''
+
+import copy
+import threading
+import time
+
+from sqlalchemy.orm import MapperExtension, SessionExtension, EXT_CONTINUE, \
+                           ColumnProperty, object_mapper, object_session
+from sqlalchemy.orm.attributes import set_committed_value, instance_state
+
+try:
+    from sqlalchemy import event
+except ImportError:
+    # SQLAlchemy < 0.7
+    event = None
+
+__doc_all__ = []
+
+DEFAULT_SIZE = 1000
+
+
+class LRUCache(object):
+    '''
+    A thread-safe least recently used cache with optional expiration of its
+    entries.
+    '''
+
+    def __init__(self, size=DEFAULT_SIZE, ttl=None):
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # key -> [previous node, next node, key, value, expiration time]
+        self.nodes = {}
+        # sentinel node of the circular list of entries, most recently used
+        # entries first
+        self.root = root = []
+        root[:] = [root, root, None, None, None]
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def _unlink(self, node):
+        prev, next = node[0], node[1]
+        prev[1] = next
+        next[0] = prev
+
+    def _remove(self, node):
+        self._unlink(node)
+        del self.nodes[node[2]]
+        self._removed(node[2], node[3])
+
+    def _added(self, key, value):
+        pass
+
+    def _removed(self, key, value):
+        pass
+
+    def get(self, key):
+        '''
+        Return a (found, value) tuple for the entry corresponding to `key`.
+        '''
+        self.lock.acquire()
+        try:
+            node = self.nodes.get(key)
+            if node is not None and node[4] is not None and \
+               node[4] < time.time():
+                self._remove(node)
+                node = None
+            if node is None:
+                self.misses += 1
+                return False, None
+            self.hits += 1
+            # move the entry to the front of the list
+            self._unlink(node)
+            root = self.root
+            node[0], node[1] = root, root[1]
+            root[1][0] = node
+            root[1] = node
+            return True, node[3]
+        finally:
+            self.lock.release()
+
+    def set(self, key, value):
+        self.lock.acquire()
+        try:
+            node = self.nodes.get(key)
+            if node is not None:
+                self._remove(node)
+            if self.ttl is not None:
+                expiration = time.time() + self.ttl
+            else:
+                expiration = None
+            root = self.root
+            node = [root, root[1], key, value, expiration]
+            root[1][0] = node
+            root[1] = node
+            self.nodes[key] = node
+            self._added(key, value)
+            while len(self.nodes) > self.size:
+                self._remove(root[0])
+                self.evictions += 1
+        finally:
+            self.lock.release()
+
+    def discard(self, key, stale=False):
+        '''
+        Remove the entry corresponding to `key`. If `stale` is True, the entry
+        was just returned by `get` but turned out to be out of date, so that
+        lookup is counted as a miss rather than a hit.
+        '''
+        self.lock.acquire()
+        try:
+            if stale:
+                self.hits -= 1
+                self.misses += 1
+            node = self.nodes.get(key)
+            if node is not None:
+                self._remove(node)
+        finally:
+            self.lock.release()
+
+    def invalidate_keys(self, *keys):
+        '''
+        Remove the entries corresponding to `keys`, because the data they
+        were computed from changed.
+        '''
+        self.lock.acquire()
+        try:
+            for key in keys:
+                node = self.nodes.get(key)
+                if node is not None:
+                    self._remove(node)
+                    self.invalidations += 1
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            for node in self.nodes.values():
+                self._remove(node)
+        finally:
+            self.lock.release()
+
+    def stats(self):
+        '''
+        Return a dictionary of statistics about the usage of the cache.
+        '''
+        return {'size': len(self.nodes), 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions,
+                'invalidations': self.invalidations}
+
+
+class QueryCache(LRUCache):
+    '''
+    A cache mapping `get_by` criteria to the primary key of the corresponding
+    instance (or to None when no instance matched).
+    '''
+
+    def __init__(self, size=DEFAULT_SIZE, ttl=None):
+        LRUCache.__init__(self, size, ttl)
+        # primary key -> keys of the entries pointing to it
+        self.keys_by_value = {}
+
+    def _added(self, key, value):
+        self.keys_by_value.setdefault(value, set()).add(key)
+
+    def _removed(self, key, value):
+        keys = self.keys_by_value.get(value)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.keys_by_value[value]
+
+    def invalidate(self, *values):
+        '''
+        Remove the entries pointing to any of the primary keys in `values`
+        (or to no instance, for None).
+        '''
+        self.lock.acquire()
+        try:
+            for value in values:
+                for key in list(self.keys_by_value.get(value, ())):
+                    self._remove(self.nodes[key])
+                    self.invalidations += 1
+        finally:
+            self.lock.release()
+
+
+class PrimaryKeyCache(LRUCache):
+    '''
+    A cache mapping primary keys to the class and column values of the
+    corresponding instance.
+    '''
+
+
+class QueryCacheExtension(MapperExtension):
+    '''
+    Invalidate the entries of a query cache when instances are inserted,
+    updated or deleted.
+    '''
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def after_insert(self, mapper, connection, instance):
+        # the new instance could match criteria which matched nothing so far
+        self.cache.invalidate(None)
+        return EXT_CONTINUE
+
+    def before_bulk_insert(self, entity, rows):
+        # bulk_insert clears the caches of the entity once the rows are
+        # inserted
+        return EXT_CONTINUE
+
+    def after_update(self, mapper, connection, instance):
+        self.cache.invalidate(None, instance_key(mapper, instance))
+        return EXT_CONTINUE
+
+    def after_delete(self, mapper, connection, instance):
+        self.cache.invalidate(instance_key(mapper, instance))
+        return EXT_CONTINUE
+
+
+class PrimaryKeyCacheExtension(MapperExtension):
+    '''
+    Invalidate the entries of a primary key cache when instances are
+    inserted, updated or deleted: once when the session is flushed, and once
+    more when it is committed or rolled back, since other sessions can cache
+    the values which are still committed in the database in the meantime.
+    '''
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def after_insert(self, mapper, connection, instance):
+        # the row disappears again if the transaction is rolled back
+        self.invalidate(mapper, instance)
+        return EXT_CONTINUE
+
+    def before_bulk_insert(self, entity, rows):
+        # bulk_insert clears the caches of the entity once the rows are
+        # inserted
+        return EXT_CONTINUE
+
+    def after_update(self, mapper, connection, instance):
+        self.invalidate(mapper, instance)
+        return EXT_CONTINUE
+
+    def after_delete(self, mapper, connection, instance):
+        self.invalidate(mapper, instance)
+        return EXT_CONTINUE
+
+    def invalidate(self, mapper, instance):
+        key = instance_key(mapper, instance)
+        self.cache.invalidate_keys(key)
+        session = object_session(instance)
+        if session is not None:
+            CommitInvalidationExtension.pending_keys(session).append(
+                (self.cache, key))
+
+
+class CommitInvalidationExtension(SessionExtension):
+    '''
+    Invalidate, when a session is committed or rolled back, the cache
+    entries of the instances it flushed since its last commit or rollback.
+    '''
+
+    @classmethod
+    def pending_keys(cls, session):
+        '''
+        Return the list of the (cache, key) pairs to invalidate when `session`
+        is committed or rolled back, installing the extension on the session
+        if needed.
+        '''
+        keys = getattr(session, '_elixir_cache_keys', None)
+        if keys is None:
+            keys = session._elixir_cache_keys = []
+            extension = cls()
+            if event is not None:
+                event.listen(session, 'after_commit', extension.after_commit)
+                event.listen(session, 'after_rollback',
+                             extension.after_rollback)
+            else:
+                session.extensions.append(extension)
+        return keys
+
+    def after_commit(self, session):
+        keys = session._elixir_cache_keys
+        session._elixir_cache_keys = []
+        for cache, key in keys:
+            cache.invalidate_keys(key)
+
+    def after_rollback(self, session):
+        # the values flushed by the session could have been cached, by the
+        # session itself or by another one sharing its connection
+        self.after_commit(session)
+
+
+def has_flushed_changes(session, cache):
+    '''
+    Return whether the current transaction of `session` flushed changes to
+    instances whose entries are stored in `cache`.
+    '''
+    for pending_cache, key in getattr(session, '_elixir_cache_keys', ()):
+        if pending_cache is cache:
+            return True
+    return False
+
+
+def instance_key(mapper, instance):
+    return tuple(mapper.primary_key_from_instance(instance))
+
+
+def make_cache(option, cache_class=QueryCache):
+    '''
+    Return the cache corresponding to the value of the ``query_cache`` (or
+    ``pk_cache``) option of an entity.
+    '''
+    if isinstance(option, LRUCache):
+        return option
+    elif isinstance(option, dict):
+        return cache_class(**option)
+    elif option is True:
+        return cache_class()
+    else:
+        return cache_class(size=option)
+
+
+def instance_values(instance):
+    '''
+    Return the class and the loaded column values of `instance`.
+    '''
+    mapper = object_mapper(instance)
+    values = []
+    for prop in mapper.iterate_properties:
+        if isinstance(prop, ColumnProperty) and not prop.deferred:
+            values.append((prop.key, getattr(instance, prop.key)))
+    return instance.__class__, tuple(values)
+
+
+def restore_instance(session, pk, cached):
+    '''
+    Rebuild an instance from the values returned by `instance_values`, and
+    merge it into `session` without querying the database.
+    '''
+    cls, values = cached
+    mapper = cls.mapper
+    instance = mapper.class_manager.new_instance()
+    for key, value in values:
+        if isinstance(value, (list, dict)):
+            # do not share mutable values between sessions
+            value = copy.deepcopy(value)
+        set_committed_value(instance, key, value)
+    instance_state(instance).key = \
+        mapper.identity_key_from_primary_key(list(pk))
+    try:
+        return session.merge(instance, load=False)
+    except TypeError:
+        # SQLAlchemy < 0.6
+        return session.merge(instance, dont_load=True)
+
+
+def cached_get(entity, cache, ident):
+    '''
+    Return the instance of `entity` with the `ident` primary key, using
+    `cache` to avoid querying the database when it is not in the session.
+    '''
+    if isinstance(ident, (list, tuple)):
+        pk = tuple(ident)
+    else:
+        pk = (ident,)
+    query = entity.query
+    session = query.session
+    key = entity.mapper.identity_key_from_primary_key(list(pk))
+    if session.identity_map.get(key) is not None:
+        # the instance in the session could have unflushed changes, which
+        # must not end up in the cache.
+        return query.get(ident)
+
+    found, cached = cache.get(pk)
+    if found and issubclass(cached[0], entity):
+        return restore_instance(session, pk, cached)
+
+    instance = query.get(ident)
+    # the values read in a transaction which changed rows of the entity are
+    # not committed yet, and could be rolled back
+    if instance is not None and not has_flushed_changes(session, cache):
+        cache.set(pk, instance_values(instance))
+    return instance
+
+
+def get_instance(entity, pk):
+    cache = entity._descriptor.pk_cache
+    if cache is not None:
+        return cached_get(entity, cache, pk)
+    return entity.query.get(pk)
+
+
+def cached_get_by(entity, cache, kwargs):
+    '''
+    Return the first instance of `entity` matching the `kwargs` criteria,
+    using `cache` to avoid running the query again for the same criteria.
+    '''
+    key = kwargs.items()
+    key.sort()
+    key = tuple(key)
+    try:
+        hash(key)
+    except TypeError:
+        return entity.query.filter_by(**kwargs).first()
+
+    found, pk = cache.get(key)
+    if found:
+        if pk is None:
+            return None
+        instance = get_instance(entity, pk)
+        # the instance could have been deleted or modified since the entry
+        # was created, without being flushed yet.
+        if instance is not None and \
+           not [1 for name, value in kwargs.iteritems()
+                if getattr(instance, name) != value]:
+            return instance
+        cache.discard(key, stale=True)
+
+    instance = entity.query.filter_by(**kwargs).first()
+    if instance is None:
+        cache.set(key, None)
+    else:
+        cache.set(key, instance_key(entity.mapper, instance))
+    return instance
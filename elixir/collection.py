@@ -7,23 +7,55 @@ import re
 class BaseCollection(list):
     def __init__(self, entities=None):
         list.__init__(self)
+        # _fullnames is a dict of the entities of the collection keyed on
+        # their fully qualified name (module path and class name).
+        self._fullnames = {}
         if entities is not None:
             self.extend(entities)
 
+    def append(self, entity):
+        '''
+        Add an entity to the collection.
+        '''
+        list.append(self, entity)
+        fullname = '%s.%s' % (entity.__module__, entity.__name__)
+        self._fullnames[fullname] = entity
+
     def extend(self, entities):
         for e in entities:
             self.append(e)
 
     def clear(self):
+        self._fullnames = {}
         del self[:]
 
+    def resolve_many(self, keys, entity=None):
+        '''
+        Resolve a list of keys to the corresponding Entities.
+        '''
+        return [self.resolve(key, entity) for key in keys]
+
     def resolve_absolute(self, key, full_path, entity=None, root=None):
-        if root is None:
+        if root is None and entity is not None:
             root = entity._descriptor.resolve_root
         if root:
             full_path = '%s.%s' % (root, full_path)
+
+        # entities of other collections are looked up in their module, so
+        # that the result is never stale (for example when that collection
+        # was cleaned up or the module reloaded)
+        res = self._fullnames.get(full_path)
+        if res is not None:
+            return res
+
         module_path, classname = full_path.rsplit('.', 1)
-        module = sys.modules[module_path]
+        module = sys.modules.get(module_path)
+        if module is None:
+            # the module defining the target was not imported yet: import it
+            # (and only it) now, rather than forcing users to import their
+            # whole model up front.
+            __import__(module_path)
+            module = sys.modules[module_path]
         res = getattr(module, classname, None)
         if res is None:
             if entity is not None:
@@ -48,7 +80,7 @@ class GlobalEntityCollection(BaseCollection):
         '''
         Add an entity to the collection.
         '''
-        super(EntityCollection, self).append(entity)
+        super(GlobalEntityCollection, self).append(entity)
 
         existing_entities = self._entities.setdefault(entity.__name__, [])
         existing_entities.append(entity)
@@ -7,20 +7,32 @@ import sys
 import types
 import warnings
 
-from copy import deepcopy
-
 import sqlalchemy
 from sqlalchemy import Table, Column, Integer, desc, ForeignKey, and_, \
-                       ForeignKeyConstraint
+                       or_, ForeignKeyConstraint
 from sqlalchemy.orm import MapperExtension, mapper, object_session, \
                            EXT_CONTINUE, polymorphic_union, ScopedSession, \
                            ColumnProperty
 from sqlalchemy.sql import ColumnCollection
+from sqlalchemy.sql.util import criterion_as_pairs
+from sqlalchemy.orm.query import Query
+try:
+    from sqlalchemy.orm.evaluator import EvaluatorCompiler, \
+                                        UnevaluatableError
+except ImportError:
+    # SQLAlchemy < 0.5 cannot evaluate criteria on instances
+    EvaluatorCompiler = None
+try:
+    from sqlalchemy.orm import subqueryload_all as eager_load_all
+except ImportError:
+    # SQLAlchemy < 0.6.0 does not have the subquery loading strategy, so we
+    # use joined eager loading instead
+    from sqlalchemy.orm import eagerload_all as eager_load_all
 
 import elixir
 from elixir.statements import process_mutators, MUTATORS
-from elixir import options
-from elixir.properties import Property
+from elixir import options, profiling
+from elixir.properties import Property, EntityBuilder
 
 DEBUG = False
 
@@ -65,6 +77,11 @@ class EntityDescriptor(object):
                 else:
                     bases.append(base)
         self.bases = bases
+
+        # names of the methods carrying Elixir markers (event decorators and
+        # the like), including those inherited from the base classes
+        self.marked_methods = collect_marked_methods(entity)
+
         if not is_entity(entity) or is_abstract_entity(entity):
             return
 
@@ -72,6 +89,10 @@ class EntityDescriptor(object):
         self.module = sys.modules.get(entity.__module__)
 
         self.builders = []
+        # number of builders which went through the whole setup. Builders
+        # added after that (to an entity which is already set up) are set up
+        # on their own the next time the entity goes through setup.
+        self.builders_done = 0
 
         #XXX: use entity.__subclasses__ ?
         self.children = []
@@ -93,6 +114,16 @@ class EntityDescriptor(object):
         #
         self.relationships = []
 
+        # index of the relationships of the entities being set up, used to
+        # find inverse relationships. Only set during setup_entities.
+        self.relationship_index = None
+
+        # to_dict serializers, keyed on their (deep, exclude) specification
+        self._serializers = {}
+
+        # class of the read-only snapshots of instances (see snapshots)
+        self._snapshot_class = None
+
         # set default value for options
         self.table_args = []
 
@@ -168,6 +199,17 @@ class EntityDescriptor(object):
             if not isinstance(self.polymorphic, basestring):
                 self.polymorphic = options.DEFAULT_POLYMORPHIC_COL_NAME
 
+        if self.query_cache is not None:
+            from elixir.cache import make_cache, QueryCacheExtension
+            self.query_cache = make_cache(self.query_cache)
+            self.add_mapper_extension(QueryCacheExtension(self.query_cache))
+
+        if self.pk_cache is not None:
+            from elixir.cache import make_cache, PrimaryKeyCache, \
+                                     PrimaryKeyCacheExtension
+            self.pk_cache = make_cache(self.pk_cache, PrimaryKeyCache)
+            self.add_mapper_extension(PrimaryKeyCacheExtension(self.pk_cache))
+
     #---------------------
     # setup phase methods
 
@@ -330,11 +372,8 @@ class EntityDescriptor(object):
         # create a list of callbacks for each event
         methods = {}
 
-        all_methods = getmembers(self.entity,
-                                 lambda a: isinstance(a, types.MethodType))
-
-        for name, method in all_methods:
-            for event in getattr(method, '_elixir_events', []):
+        for method in self.get_marked_methods('_elixir_events'):
+            for event in method._elixir_events:
                 event_methods = methods.setdefault(event, [])
                 event_methods.append(method)
 
@@ -351,6 +390,19 @@ class EntityDescriptor(object):
         # then, make sure that the entity's mapper has our mapper extension
         self.add_mapper_extension(ext)
 
+    def get_marked_methods(self, marker):
+        '''
+        Return the (bound) methods of the entity which carry the `marker`
+        attribute, in alphabetical order of their names.
+        '''
+        methods = []
+        for name in self.marked_methods:
+            method = getattr(self.entity, name, None)
+            if isinstance(method, types.MethodType) and \
+               getattr(method, marker, False):
+                methods.append(method)
+        return methods
+
     def before_mapper(self):
         self.call_builders('before_mapper')
 
@@ -472,14 +524,25 @@ class EntityDescriptor(object):
     def finalize(self):
         self.call_builders('finalize')
         self.entity._setup_done = True
+        self.builders_done = len(self.builders)
+        setup_registry.discard_changed(self.entity)
+        # properties could have been added since the serializers and the
+        # snapshot class were created
+        self._serializers = {}
+        self._snapshot_class = None
 
     #----------------
     # helper methods
 
     def call_builders(self, what):
-        for builder in self.builders:
+        profiler = profiling.profiler
+        for builder in self.builders[self.builders_done:]:
             if hasattr(builder, what):
-                getattr(builder, what)()
+                if profiler is None:
+                    getattr(builder, what)()
+                else:
+                    profiler.call(what, self.entity, builder,
+                                  getattr(builder, what))
 
     def add_column(self, col, check_duplicate=None):
         '''when check_duplicate is None, the value of the allowcoloverride
@@ -558,9 +621,14 @@ class EntityDescriptor(object):
         '''
         Return the inverse relation of rel, if any, None otherwise.
         '''
+        index = self.relationship_index
+        if index is not None:
+            candidates = index.get_relationships(self.entity, rel.entity)
+        else:
+            candidates = self.relationships
 
         matching_rel = None
-        for other_rel in self.relationships:
+        for other_rel in candidates:
             if rel.is_inverse(other_rel):
                 if matching_rel is None:
                     matching_rel = other_rel
@@ -659,6 +727,604 @@ class EntityDescriptor(object):
             self._pk_props = [col_to_prop[c] for c in pk_cols]
         return self._pk_props
 
+    def get_serializer(self, deep, exclude, key=None):
+        '''
+        Return the serializer turning instances of the entity into
+        dictionaries, for the given `deep` and `exclude` specification (see
+        `EntityBase.to_dict`). Serializers are cached, so this shouldn't be
+        called before the entity is fully set up.
+        '''
+        if key is None:
+            key = serializer_key(deep, exclude)
+        serializer = self._serializers.get(key)
+        if serializer is None:
+            serializer = self._serializers[key] = \
+                DictSerializer(self.entity, deep, exclude)
+        return serializer
+
+    def get_snapshot_class(self):
+        '''
+        Return the class of the read-only snapshots of the instances of the
+        entity, creating it if needed.
+        '''
+        if self._snapshot_class is None:
+            self._snapshot_class = make_snapshot_class(self.entity)
+        return self._snapshot_class
+
+
+class Snapshot(object):
+    '''
+    Base class of the read-only snapshots of instances returned by
+    `EntityBase.snapshots`.
+    '''
+    __slots__ = ()
+
+    # the entity the snapshots come from, and the __set__ methods of the
+    # slots, in the order of the values given to the constructor. Both are
+    # set on the generated subclasses.
+    _entity = None
+    _setters = ()
+
+    def __init__(self, *values):
+        for setter, value in zip(self._setters, values):
+            setter(self, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Snapshots of %s instances are read-only."
+                             % self._entity.__name__)
+
+    def __delattr__(self, name):
+        raise AttributeError("Snapshots of %s instances are read-only."
+                             % self._entity.__name__)
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__,
+                            ', '.join(['%s=%r' % (name, getattr(self, name))
+                                       for name in self.__slots__]))
+
+
+def make_snapshot_class(entity):
+    '''
+    Create a class with a slot for each column property of `entity`
+    (relationships are only available through their foreign key columns).
+    '''
+    names = [prop.key for prop in entity.mapper.iterate_properties
+             if isinstance(prop, ColumnProperty)]
+    cls = type('%sSnapshot' % entity.__name__, (Snapshot,),
+               {'__slots__': tuple(names), '_entity': entity})
+    cls._setters = [cls.__dict__[name].__set__ for name in names]
+    return cls
+
+
+def serializer_key(deep, exclude):
+    '''
+    Return a hashable version of a (deep, exclude) to_dict specification.
+    '''
+    def deep_key(deep):
+        return tuple(sorted([(name, deep_key(value))
+                             for name, value in deep.iteritems()]))
+    return deep_key(deep), tuple(sorted(exclude))
+
+
+class DictSerializer(object):
+    '''
+    Turn instances of an entity into JSON-style nested dictionaries, for a
+    given specification of the relationships to follow (`deep`) and of the
+    columns to leave out (`exclude`). The names of the column properties and
+    the columns to exclude from the related instances are computed once,
+    when the serializer is created.
+    '''
+
+    def __init__(self, entity, deep, exclude):
+        mapper = entity.mapper
+        self.names = [p.key for p in mapper.iterate_properties
+                      if isinstance(p, ColumnProperty) and
+                         p.key not in exclude]
+        self.relations = []
+        for rname, rdeep in deep.iteritems():
+            #FIXME: use attribute names (ie coltoprop) instead of column names
+            fks = mapper.get_property(rname).remote_side
+            rexclude = [c.name for c in fks]
+            # the serializers of the related instances, keyed on their class
+            self.relations.append((rname, SerializerCache(rdeep, rexclude)))
+
+    def __call__(self, instance):
+        data = dict([(name, getattr(instance, name)) for name in self.names])
+        for rname, serializers in self.relations:
+            dbdata = getattr(instance, rname)
+            if dbdata is None:
+                data[rname] = None
+            elif isinstance(dbdata, list):
+                data[rname] = [serializers.get(o.__class__)(o)
+                               for o in dbdata]
+            else:
+                data[rname] = serializers.get(dbdata.__class__)(dbdata)
+        return data
+
+
+def eager_load_paths(deep, prefix=''):
+    '''
+    Return the relationship paths (dotted names) of a to_dict `deep`
+    specification, one for each leaf of the specification.
+    '''
+    paths = []
+    for name, subdeep in sorted(deep.items()):
+        path = prefix + name
+        if subdeep:
+            paths.extend(eager_load_paths(subdeep, path + '.'))
+        else:
+            paths.append(path)
+    return paths
+
+
+def eager_load_options(deep):
+    '''
+    Return the query options loading all the relationships of a to_dict
+    `deep` specification along with the instances they belong to.
+    '''
+    return [eager_load_all(path) for path in eager_load_paths(deep)]
+
+
+def prefetch_nested_rows(entity, rows):
+    '''
+    Load the existing instances corresponding to the rows nested in `rows`
+    (a list of from_dict dictionaries for `entity`), at any depth, using one
+    query per related entity and nesting level. Returns the list of those
+    instances.
+    '''
+    fetched = []
+    level = [(entity, rows)]
+    while level:
+        # nested rows of the current level, grouped by entity
+        groups = {}
+        order = []
+        for cls, cls_rows in level:
+            mapper = cls.mapper
+            for row in cls_rows:
+                for key, value in row.iteritems():
+                    if isinstance(value, dict):
+                        nested = [value]
+                    elif isinstance(value, list) and value and \
+                         isinstance(value[0], dict):
+                        nested = [item for item in value
+                                  if isinstance(item, dict)]
+                    else:
+                        continue
+                    rel_mapper = getattr(mapper.get_property(key), 'mapper',
+                                         None)
+                    if rel_mapper is None:
+                        continue
+                    rel_class = rel_mapper.class_
+                    if rel_class not in groups:
+                        groups[rel_class] = []
+                        order.append(rel_class)
+                    groups[rel_class].extend(nested)
+
+        level = []
+        for rel_class in order:
+            rel_rows = groups[rel_class]
+            pk_props = rel_class._descriptor.primary_key_properties
+            pk_tuples = [tuple([row[prop.key] for prop in pk_props])
+                         for row in rel_rows
+                         if not [1 for p in pk_props
+                                 if row.get(p.key) is None]]
+            fetched.extend(rel_class._fetch_by_pks(pk_tuples).values())
+            level.append((rel_class, rel_rows))
+    return fetched
+
+
+def clear_query_caches(entity):
+    '''
+    Clear the get_by and get caches of the entities of the inheritance
+    hierarchy of `entity`, after an operation which bypassed the mapper
+    extensions which normally invalidate them.
+    '''
+    root = entity
+    while root._descriptor.parent is not None:
+        root = root._descriptor.parent
+    for member in [root] + root._descriptor._get_children():
+        desc = member._descriptor
+        for cache in (desc.query_cache, desc.pk_cache):
+            if cache is not None:
+                cache.clear()
+
+
+def bulk_insert_extensions(entity):
+    '''
+    Return the mapper extensions of `entity` (and of its parents) which need
+    to be called by `bulk_insert`, and raise an exception if some of its
+    extensions hook into inserts without supporting them.
+    '''
+    result = []
+    desc = entity._descriptor
+    while desc is not None:
+        extensions = desc.mapper_options.get('extension', [])
+        if not isinstance(extensions, list):
+            extensions = [extensions]
+        for ext in extensions:
+            if ext in result:
+                continue
+            if hasattr(ext, 'before_bulk_insert'):
+                result.append(ext)
+                continue
+            for name in ('before_insert', 'after_insert'):
+                method = getattr(ext.__class__, name, None)
+                base_method = getattr(MapperExtension, name, None)
+                if method is not None and \
+                   getattr(method, 'im_func', method) is not \
+                   getattr(base_method, 'im_func', base_method):
+                    raise Exception("Cannot bulk insert rows of entity '%s': "
+                                    "its mapper extension %s hooks into "
+                                    "inserts without supporting bulk inserts "
+                                    "(it has no before_bulk_insert method)."
+                                    % (entity.__name__,
+                                       ext.__class__.__name__))
+        if desc.parent is None or desc.inheritance == 'concrete':
+            break
+        desc = desc.parent._descriptor
+    return result
+
+
+def inheritance_tables(mapper):
+    '''
+    Return the tables rows of the class mapped by `mapper` are stored in,
+    base tables first.
+    '''
+    tables = []
+    while mapper is not None:
+        if mapper.local_table not in tables:
+            tables.insert(0, mapper.local_table)
+        if getattr(mapper, 'concrete', False):
+            break
+        mapper = mapper.inherits
+    return tables
+
+
+def column_values(mapper, row):
+    '''
+    Convert a dictionary of column property values to a dictionary keyed on
+    the corresponding columns, adding the values generated by the mapper
+    (polymorphic identity, initial version number).
+    '''
+    values = {}
+    for key, value in row.iteritems():
+        prop = mapper.get_property(key)
+        if not hasattr(prop, 'columns'):
+            raise Exception("Cannot bulk insert a value for '%s', as it is "
+                            "not a column property." % key)
+        for col in prop.columns:
+            values[col] = value
+
+    polymorphic_on = getattr(mapper, 'polymorphic_on', None)
+    if polymorphic_on is not None and polymorphic_on not in values:
+        values[polymorphic_on] = mapper.polymorphic_identity
+    version_id_col = getattr(mapper, 'version_id_col', None)
+    if version_id_col is not None and version_id_col not in values:
+        values[version_id_col] = 1
+    return values
+
+
+def inserted_primary_key(result):
+    if hasattr(result, 'inserted_primary_key'):
+        return result.inserted_primary_key
+    return result.last_inserted_ids()
+
+
+def inherit_pairs(mapper, table):
+    '''
+    Return the (parent column, child column) pairs of the condition joining
+    `table` to the table of its parent, in the inheritance hierarchy of the
+    class mapped by `mapper`.
+    '''
+    while mapper is not None:
+        parent = mapper.inherits
+        if mapper.local_table is table and \
+           (parent is None or parent.local_table is not table):
+            if parent is None or mapper.inherit_condition is None:
+                return []
+            return criterion_as_pairs(mapper.inherit_condition,
+                                      consider_as_foreign_keys=set(table.c))
+        mapper = parent
+    return []
+
+
+def insert_table_rows(session, mapper, table, values, need_pk):
+    '''
+    Insert into `table` the rows described by `values`, a list of
+    dictionaries keyed on columns, using executemany for rows with the same
+    columns. If `need_pk` is True, rows missing their primary key are
+    inserted one at a time, and the generated key is added to their values.
+    '''
+    pk_cols = list(table.primary_key.columns)
+    pairs = inherit_pairs(mapper, table)
+    stmt = table.insert()
+    groups = {}
+    order = []
+    for row_values in values:
+        # the columns of a child table joining it to its parent table
+        # (usually its primary key) take the values of the parent columns.
+        for parent_col, col in pairs:
+            if col not in row_values and parent_col in row_values:
+                row_values[col] = row_values[parent_col]
+        params = dict([(col.key, row_values[col]) for col in table.c
+                       if col in row_values])
+        if need_pk and [1 for col in pk_cols if col not in row_values]:
+            result = session.execute(stmt, params, mapper=mapper)
+            for col, value in zip(pk_cols, inserted_primary_key(result)):
+                row_values[col] = value
+            continue
+        keys = params.keys()
+        keys.sort()
+        keys = tuple(keys)
+        if keys not in groups:
+            groups[keys] = []
+            order.append(keys)
+        groups[keys].append(params)
+    for keys in order:
+        session.execute(stmt, groups[keys], mapper=mapper)
+
+
+def primary_key_condition(columns, pk_tuples):
+    '''
+    Return a condition matching the rows whose `columns` have the values of
+    one of the tuples in `pk_tuples`.
+    '''
+    if len(columns) == 1:
+        return columns[0].in_([pk_tuple[0] for pk_tuple in pk_tuples])
+    return or_(*[and_(*[col == value for col, value in zip(columns, pk_tuple)])
+                 for pk_tuple in pk_tuples])
+
+
+def single_table_criterion(entity):
+    '''
+    Return the criterion restricting the rows of the table of `entity` to
+    those of `entity` and its children, if it uses "single" inheritance and
+    shares its table with its parent. Returns None otherwise.
+    '''
+    desc = entity._descriptor
+    polymorphic_on = entity.mapper.polymorphic_on
+    if not desc.parent or desc.inheritance != 'single' or \
+       polymorphic_on is None:
+        return None
+    identities = [desc.identity]
+    identities.extend([child._descriptor.identity
+                       for child in desc._get_children()])
+    return polymorphic_on.in_(identities)
+
+
+def where_tables(entity):
+    '''
+    Return the tables rows of `entity` are stored in, leaf tables first, and
+    whether rows need to be selected by primary key (rather than using the
+    criteria directly) because they are spread over several tables.
+    '''
+    tables = inheritance_tables(entity.mapper)
+    tables.reverse()
+    for child in entity._descriptor._get_children():
+        child_desc = child._descriptor
+        if child_desc.inheritance == 'multi' and child.table not in tables:
+            tables.insert(0, child.table)
+    return tables, len(tables) > 1
+
+
+def matching_instances(entity, session, criteria):
+    '''
+    Return the instances of `entity` present in `session` which match
+    `criteria`, or None if the criteria cannot be evaluated in Python.
+    '''
+    instances = [obj for obj in session.identity_map.values()
+                 if isinstance(obj, entity)]
+    if not instances:
+        return []
+    if EvaluatorCompiler is None:
+        return None
+    try:
+        evaluate = EvaluatorCompiler().process(and_(*criteria))
+    except UnevaluatableError:
+        return None
+    return [obj for obj in instances if evaluate(obj)]
+
+
+def select_primary_keys(entity, session, criteria):
+    pk_cols = list(entity.mapper.primary_key)
+    query = sqlalchemy.select(pk_cols, and_(*criteria),
+                              from_obj=[entity.mapper.mapped_table])
+    return [tuple(row)
+            for row in session.execute(query, mapper=entity.mapper)]
+
+
+def identity_map_instances(entity, session, pk_tuples):
+    instances = []
+    for pk_tuple in pk_tuples:
+        key = entity.mapper.identity_key_from_primary_key(list(pk_tuple))
+        instance = session.identity_map.get(key)
+        if instance is not None:
+            instances.append(instance)
+    return instances
+
+
+# number of primary keys per IN clause, to stay below the limit on the number
+# of parameters of some databases
+PK_CHUNK_SIZE = 500
+
+
+def execute_where(entity, criteria, make_statement):
+    '''
+    Execute the statements built by `make_statement(table, whereclause)` (or
+    skipped when it returns None) for each of the tables `entity` is stored
+    in, restricting them to the rows matching `criteria`. Returns the number
+    of matched rows, and the matching instances present in the session (or
+    None if they are unknown).
+    '''
+    session = entity.query.session
+    # pending changes need to be taken into account by the criteria
+    session.flush()
+
+    criteria = list(criteria)
+    criterion = single_table_criterion(entity)
+    if criterion is not None:
+        criteria.append(criterion)
+
+    tables, by_pk = where_tables(entity)
+    instances = None
+    if not by_pk:
+        instances = matching_instances(entity, session, criteria)
+    if instances is None:
+        by_pk_tuples = select_primary_keys(entity, session, criteria)
+        instances = identity_map_instances(entity, session, by_pk_tuples)
+    else:
+        by_pk_tuples = None
+
+    if by_pk_tuples is None:
+        stmt = make_statement(tables[0], and_(*criteria))
+        count = 0
+        if stmt is not None:
+            count = session.execute(stmt, mapper=entity.mapper).rowcount
+        return count, instances
+
+    for start in range(0, len(by_pk_tuples), PK_CHUNK_SIZE):
+        chunk = by_pk_tuples[start:start + PK_CHUNK_SIZE]
+        for table in tables:
+            # the primary key columns of the tables of an inheritance
+            # hierarchy are in the same order
+            whereclause = primary_key_condition(
+                list(table.primary_key.columns), chunk)
+            stmt = make_statement(table, whereclause)
+            if stmt is not None:
+                session.execute(stmt, mapper=entity.mapper)
+    return len(by_pk_tuples), instances
+
+
+def delete_where(entity, criteria):
+    def make_statement(table, whereclause):
+        return table.delete(whereclause)
+
+    count, instances = execute_where(entity, criteria, make_statement)
+    clear_query_caches(entity)
+    session = entity.query.session
+    for instance in instances:
+        session.expunge(instance)
+    return count
+
+
+def update_where(entity, criteria, values):
+    table_values = {}
+    for key, value in values.iteritems():
+        prop = entity.mapper.get_property(key)
+        if not hasattr(prop, 'columns'):
+            raise Exception("Cannot update '%s' with update_where, as it is "
+                            "not a column property." % key)
+        for col in prop.columns:
+            table_values.setdefault(col.table, {})[col.key] = value
+
+    def make_statement(table, whereclause):
+        if table not in table_values:
+            return None
+        return table.update(whereclause, values=table_values[table])
+
+    count, instances = execute_where(entity, criteria, make_statement)
+    clear_query_caches(entity)
+    session = entity.query.session
+    for instance in instances:
+        session.expire(instance, values.keys())
+    return count
+
+
+def keyset_condition(columns, values):
+    '''
+    Return a condition selecting the rows whose values for `columns` come
+    after `values`, in lexicographic order.
+    '''
+    clauses = []
+    for num, col in enumerate(columns):
+        equals = [columns[i] == values[i] for i in range(num)]
+        clauses.append(and_(*(equals + [col > values[num]])))
+    return or_(*clauses)
+
+
+def stream_batches(query, mapper, batch_size, deep):
+    '''
+    Yield the instances returned by `query` (a query on the `mapper` mapper)
+    in lists of at most `batch_size`
+    instances, fetched one batch at a time in primary key order (using
+    "keyset" pagination, which does not slow down as the offset grows).
+    The instances loaded for a batch (including related instances) are
+    removed from the session once the next batch is requested.
+    '''
+    pk_cols = list(mapper.primary_key)
+    query = query.order_by(None).order_by(*pk_cols)
+    if deep:
+        query = query.options(*eager_load_options(deep))
+    session = query.session
+    # objects which were in the session before streaming started are left
+    # there
+    before = set(session.identity_map.keys())
+
+    last = None
+    while True:
+        batch_query = query
+        if last is not None:
+            batch_query = batch_query.filter(keyset_condition(pk_cols, last))
+        batch = batch_query.limit(batch_size).all()
+        if not batch:
+            break
+        last = mapper.primary_key_from_instance(batch[-1])
+        yield batch
+        for key, obj in session.identity_map.items():
+            # instances may already have been removed by the expunge cascade
+            # of one of their parents
+            if key not in before and obj in session:
+                session.expunge(obj)
+
+
+class SerializerCache(object):
+    '''
+    The serializers for one (deep, exclude) specification, keyed on the class
+    of the instances to serialize (which can differ, for example when using
+    polymorphic inheritance).
+    '''
+
+    def __init__(self, deep, exclude):
+        self.deep = deep
+        self.exclude = exclude
+        self.key = serializer_key(deep, exclude)
+        self.serializers = {}
+
+    def get(self, cls):
+        serializer = self.serializers.get(cls)
+        if serializer is None:
+            if cls.to_dict.im_func is EntityBase.to_dict.im_func:
+                # the serializer itself is cached by the descriptor, which
+                # drops it when properties are added to the entity
+                return cls._descriptor.get_serializer(self.deep, self.exclude,
+                                                      self.key)
+            # honor the to_dict method of entities which override it
+            deep, exclude = self.deep, self.exclude
+            def serializer(instance):
+                return instance.to_dict(deep, exclude)
+            self.serializers[cls] = serializer
+        return serializer
+
+
+class RelationshipIndex(object):
+    '''
+    Index of the relationships of a list of entities, keyed on the entity
+    they are defined on and their target. It is used to look up the possible
+    inverses of a relationship without scanning all the relationships of the
+    target entity.
+    '''
+
+    def __init__(self, entities):
+        self.relationships = {}
+        for entity in entities:
+            for rel in entity._descriptor.relationships:
+                key = (rel.entity, rel.target)
+                self.relationships.setdefault(key, []).append(rel)
+
+    def get_relationships(self, entity, target):
+        return self.relationships.get((entity, target), [])
+
+
 class FakePK(object):
     def __init__(self, descriptor):
         self.descriptor = descriptor
@@ -715,6 +1381,36 @@ def getmembers(object, predicate=None):
             base_props.append((key, value))
     return base_props
 
+def is_marked(value):
+    '''
+    Return whether `value` is a function carrying an Elixir marker (ie an
+    attribute whose name starts with "_elixir_", as set by the event
+    decorators).
+    '''
+    if not isinstance(value, types.FunctionType):
+        return False
+    for key in value.__dict__:
+        if key.startswith('_elixir_'):
+            return True
+    return False
+
+def collect_marked_methods(cls):
+    '''
+    Return the sorted names of the marked methods of a class. The registries
+    of entity bases are reused, so only the dictionary of the class itself
+    (and of the non-entity classes it inherits from) need to be scanned.
+    '''
+    names = set()
+    for klass in cls.__mro__:
+        if klass is not cls and isinstance(klass, EntityMeta) and \
+           '_descriptor' in klass.__dict__:
+            names.update(klass._descriptor.marked_methods)
+        else:
+            for key, value in klass.__dict__.iteritems():
+                if is_marked(value):
+                    names.add(key)
+    return sorted(names)
+
 def is_abstract_entity(dict_or_cls):
     if not isinstance(dict_or_cls, dict):
         dict_or_cls = dict_or_cls.__dict__
@@ -752,7 +1448,7 @@ def instrument_class(cls):
     for base in cls.__bases__:
         if isinstance(base, EntityMeta) and \
            (not is_entity(base) or is_abstract_entity(base)):
-            base_props += [(name, deepcopy(attr)) for name, attr in
+            base_props += [(name, attr.clone()) for name, attr in
                            getmembers(base, lambda a: isinstance(a, Property))]
 
     # Process attributes (using the assignment syntax), looking for
@@ -764,6 +1460,8 @@ def instrument_class(cls):
     for name, prop in sorted_props:
         prop.attach(cls, name)
 
+    setup_registry.mark_changed(cls)
+
     # setup misc options here (like tablename etc.)
     desc.setup_options()
 
@@ -778,35 +1476,111 @@ class EntityMeta(type):
     def __init__(cls, name, bases, dict_):
         instrument_class(cls)
 
+    def __call__(cls, *args, **kwargs):
+        trigger = cls.__dict__.get('mapper')
+        if isinstance(trigger, LazySetupTrigger):
+            trigger.lazy_setup.setup(cls)
+        return type.__call__(cls, *args, **kwargs)
+
     def __setattr__(cls, key, value):
         if isinstance(value, Property):
-            if hasattr(cls, '_setup_done'):
+            # in incremental mode, properties added to an entity which is
+            # already set up are set up (on their own) the next time
+            # setup_all is called.
+            if hasattr(cls, '_setup_done') and not setup_registry.incremental:
                 raise Exception('Cannot set attribute on a class after '
-                                'setup_all')
-            else:
-                value.attach(cls, key)
+                                'setup_all (unless it is called with '
+                                'incremental=True)')
+            value.attach(cls, key)
+            setup_registry.mark_changed(cls)
         else:
             type.__setattr__(cls, key, value)
+            if is_marked(value) and '_descriptor' in cls.__dict__:
+                marked_methods = cls._descriptor.marked_methods
+                if key not in marked_methods:
+                    marked_methods.append(key)
+                    marked_methods.sort()
+
+
+def resolve_targets(entities):
+    '''
+    Resolve the targets of the relationships of the entities in the list
+    passed as argument which are not set up yet. Resolving a target can
+    import the module defining it, and thus add entities to the list (if it
+    is the collection of those entities), which are resolved in turn.
+    '''
+    num = 0
+    while num < len(entities):
+        entity = entities[num]
+        num += 1
+        if hasattr(entity, '_setup_done'):
+            continue
+        for rel in entity._descriptor.relationships:
+            rel.target
 
 
 def setup_entities(entities):
     '''Setup all entities in the list passed as argument'''
 
     for entity in entities:
-        # delete all Elixir properties so that it doesn't interfere with
-        # SQLAlchemy. At this point they should have be converted to
-        # builders.
-        for name, attr in entity.__dict__.items():
-            if isinstance(attr, Property):
-                delattr(entity, name)
-
-    for method_name in (
-            'setup_autoload_table', 'create_pk_cols', 'setup_relkeys',
-            'before_table', 'setup_table', 'setup_reltables', 'after_table',
-            'setup_events',
-            'before_mapper', 'setup_mapper', 'after_mapper',
-            'setup_properties',
-            'finalize'):
+        remove_property_attrs(entity)
+
+    # Index the relationships of the entities once, so that looking for
+    # the inverse of a relationship doesn't need to scan all relationships
+    # of its target. Entities which are not part of this setup run (because
+    # they were set up before) keep using the scan.
+    pending = [entity for entity in entities
+               if not hasattr(entity, '_setup_done')]
+    # entities which are already set up but received new properties since
+    # then
+    updated = [entity for entity in entities
+               if hasattr(entity, '_setup_done') and
+                  entity._descriptor.builders_done <
+                  len(entity._descriptor.builders)]
+    setup_changed_entities(pending, updated)
+
+
+def remove_property_attrs(entity):
+    # delete all Elixir properties so that it doesn't interfere with
+    # SQLAlchemy. At this point they should have be converted to
+    # builders.
+    for name, attr in entity.__dict__.items():
+        if isinstance(attr, Property):
+            delattr(entity, name)
+
+
+def setup_changed_entities(pending, updated):
+    index = RelationshipIndex(pending + updated)
+    for entity in pending + updated:
+        entity._descriptor.relationship_index = index
+    try:
+        setup_phases(pending, updated)
+    finally:
+        for entity in pending + updated:
+            entity._descriptor.relationship_index = None
+
+
+SETUP_PHASES = (
+    'setup_autoload_table', 'create_pk_cols', 'setup_relkeys',
+    'before_table', 'setup_table', 'setup_reltables', 'after_table',
+    'setup_events',
+    'before_mapper', 'setup_mapper', 'after_mapper',
+    'setup_properties',
+    'finalize'
+)
+
+# The phases which are run for the new builders of entities which are already
+# set up. The other phases create the table, primary key and mapper of the
+# entity, which already exist: the new builders add their columns and
+# properties to the live table and mapper instead.
+INCREMENTAL_PHASES = (
+    'setup_relkeys', 'before_table', 'setup_reltables', 'after_table',
+    'before_mapper', 'after_mapper', 'setup_properties', 'finalize'
+)
+
+
+def setup_phases(entities, updated=()):
+    for method_name in SETUP_PHASES:
 #        if DEBUG:
 #            print "=" * 40
 #            print method_name
@@ -816,9 +1590,306 @@ def setup_entities(entities):
             if hasattr(entity, '_setup_done'):
 #                print "already done"
                 continue
-            method = getattr(entity._descriptor, method_name)
-            method()
+            call_phase(entity, method_name)
 #            print "ok"
+        if method_name in INCREMENTAL_PHASES:
+            for entity in updated:
+                call_phase(entity, method_name)
+
+
+def call_phase(entity, method_name):
+    method = getattr(entity._descriptor, method_name)
+    profiler = profiling.profiler
+    if profiler is None:
+        method()
+    else:
+        profiler.call(method_name, entity, None, method)
+
+
+class SetupRegistry(object):
+    '''
+    Keep track of the entities which were declared or received new
+    properties since they were last set up, so that
+    `incremental_setup_entities` only needs to look at what changed.
+    '''
+
+    def __init__(self):
+        # whether the incremental setup mode was used since the last cleanup
+        self.incremental = False
+        # the changed entities, and the order in which they were marked.
+        # Entities are discarded from the set only, so that doing so does not
+        # need to search the list.
+        self._changed = set()
+        self._order = []
+
+    @property
+    def changed(self):
+        return [entity for entity in self._order if entity in self._changed]
+
+    def mark_changed(self, entity):
+        # the serializers and snapshot class of the entity (and of its
+        # children, which inherit its properties) need to be created again
+        # to include the new properties
+        desc = entity._descriptor
+        for member in [entity] + desc._get_children():
+            member._descriptor._serializers = {}
+            member._descriptor._snapshot_class = None
+        if entity not in self._changed:
+            self._changed.add(entity)
+            self._order.append(entity)
+
+    def pop_changed(self, collection):
+        '''
+        Remove the changed entities belonging to `collection` from the
+        registry and return them, in declaration order.
+        '''
+        result = []
+        remaining = []
+        for entity in self._order:
+            if entity not in self._changed:
+                continue
+            if entity._descriptor.collection is collection:
+                result.append(entity)
+                self._changed.discard(entity)
+            else:
+                remaining.append(entity)
+        self._order = remaining
+        return result
+
+    def discard_changed(self, entity):
+        self._changed.discard(entity)
+        # compact the list once most of its entries were discarded
+        if len(self._order) > 2 * len(self._changed) + 32:
+            self._order = self.changed
+
+    def forget(self, entity):
+        self.discard_changed(entity)
+
+    def clear(self):
+        '''
+        Forget all the changed entities.
+        '''
+        self._changed = set()
+        self._order = []
+
+    def reset(self):
+        '''
+        Forget all the changed entities, and leave the incremental mode.
+        '''
+        self.clear()
+        self.incremental = False
+
+setup_registry = SetupRegistry()
+
+
+def incremental_setup_entities(entities):
+    '''
+    Setup the entities of the collection passed as argument which were
+    declared since the last setup, as well as the properties which were added
+    to entities already set up. As opposed to `setup_entities`, this does not
+    go through all the entities of the collection, so its cost depends on the
+    size of the change and not on the size of the model.
+
+    The columns and properties added to entities already set up are added to
+    their existing table and mapper. Note that the corresponding columns are
+    not added to the database tables by `create_all`. Properties can only be
+    added to entities already set up once this function has been used (until
+    the entities are cleaned up).
+    '''
+    setup_registry.incremental = True
+    pending = []
+    updated = []
+    for entity in setup_registry.pop_changed(entities):
+        desc = entity._descriptor
+        if not hasattr(entity, '_setup_done'):
+            remove_property_attrs(entity)
+            pending.append(entity)
+        elif desc.builders_done < len(desc.builders):
+            updated.append(entity)
+    setup_changed_entities(pending, updated)
+
+
+class LazySetupTrigger(object):
+    '''
+    Placeholder for the "table", "mapper" and "query" attributes of an entity
+    which is set up lazily. Accessing any of them sets up the entity, along
+    with the entities it depends on, and returns the real value.
+    '''
+
+    def __init__(self, lazy_setup, name):
+        self.lazy_setup = lazy_setup
+        self.name = name
+
+    def __get__(self, instance, owner):
+        self.lazy_setup.setup(owner)
+        return getattr(owner, self.name)
+
+
+class LazySetup(object):
+    '''
+    Defer the setup of a list of entities until each of them is first used.
+    '''
+
+    trigger_names = ('table', 'mapper', 'query')
+
+    def __init__(self, entities):
+        # the list of entities can be a collection, which grows when the
+        # module defining the target of a relationship is imported
+        self.collection = entities
+        self.num_seen = len(entities)
+        self.entities = [entity for entity in entities
+                         if not hasattr(entity, '_setup_done')]
+        self.positions = dict((entity, num)
+                              for num, entity in enumerate(self.entities))
+
+    def install(self, entities=None):
+        if entities is None:
+            entities = self.entities
+        for entity in entities:
+            for name in self.trigger_names:
+                type.__setattr__(entity, name, LazySetupTrigger(self, name))
+
+    def add_new_entities(self):
+        '''
+        Defer the setup of the entities added to the collection since the
+        last call, typically by importing the module defining the target of a
+        relationship.
+        '''
+        new = [entity for entity in self.collection[self.num_seen:]
+               if not hasattr(entity, '_setup_done') and
+                  entity not in self.positions]
+        self.num_seen = len(self.collection)
+        for entity in new:
+            self.positions[entity] = len(self.entities)
+            self.entities.append(entity)
+        self.install(new)
+
+    def is_pending(self, entity):
+        trigger = entity.__dict__.get('mapper')
+        return isinstance(trigger, LazySetupTrigger) and \
+               trigger.lazy_setup is self
+
+    def closure(self, entity):
+        '''
+        Return the pending entities which need to be set up together with
+        `entity`: its parent and children entities, the targets of its
+        relationships (which hold the inverse relationships), and recursively
+        the same for all of those.
+        '''
+        closure = set()
+        to_visit = [entity]
+        while to_visit:
+            entity = to_visit.pop()
+            if entity in closure or not self.is_pending(entity):
+                continue
+            closure.add(entity)
+
+            desc = entity._descriptor
+            if desc.parent:
+                to_visit.append(desc.parent)
+            to_visit.extend(desc.children)
+            for rel in desc.relationships:
+                # resolving the target can import the module defining it
+                target = rel.target
+                if isinstance(target, EntityMeta):
+                    if not hasattr(target, '_setup_done') and \
+                       not self.is_pending(target):
+                        self.add_new_entities()
+                    to_visit.append(target)
+        # keep the original order so that parents are set up before their
+        # children
+        return sorted(closure, key=self.positions.__getitem__)
+
+    def setup(self, entity):
+        entities = self.closure(entity)
+        for entity in entities:
+            type.__setattr__(entity, 'table', None)
+            type.__setattr__(entity, 'mapper', None)
+            type.__delattr__(entity, 'query')
+        setup_entities(entities)
+
+
+def lazy_setup_entities(entities):
+    '''
+    Setup the entities in the list passed as argument lazily: each entity is
+    only set up (along with its parent and children entities and the targets
+    of its relationships) the first time its table, mapper or query
+    attributes are accessed or it is instantiated.
+    '''
+    LazySetup(entities).install()
+
+
+def state_size(obj, seen):
+    '''
+    Return the approximate size in bytes of the setup-time state `obj`: the
+    containers and builders it is made of, and the strings they hold. Other
+    objects (classes, SQLAlchemy columns, types, ...) are not counted since
+    they are shared with the runtime objects (tables and mappers).
+    '''
+    if id(obj) in seen:
+        return 0
+    if isinstance(obj, dict):
+        seen.add(id(obj))
+        size = sys.getsizeof(obj)
+        for key, value in obj.iteritems():
+            size += state_size(key, seen) + state_size(value, seen)
+        return size
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        seen.add(id(obj))
+        size = sys.getsizeof(obj)
+        for item in obj:
+            size += state_size(item, seen)
+        return size
+    elif isinstance(obj, basestring):
+        seen.add(id(obj))
+        return sys.getsizeof(obj)
+    elif isinstance(obj, EntityBuilder):
+        seen.add(id(obj))
+        return sys.getsizeof(obj) + state_size(obj.__dict__, seen)
+    return 0
+
+
+def freeze_entities(entities):
+    '''
+    Release the state which is only needed to set up the entities passed as
+    argument (builders, properties, relationships, columns and constraints
+    waiting for a table, and class mutators) once they are set up. Entities
+    which are not set up yet are left untouched.
+
+    Entities inheriting from, or having relationships to, a frozen entity
+    can still be declared and set up afterwards, but inverse relationships
+    defined on the frozen entity are not detected anymore, so this should
+    only be used once the model is complete.
+
+    Returns a dictionary of the approximate number of bytes released for
+    each entity, keyed on the entity name (the values are None when the
+    Python interpreter cannot measure object sizes).
+    '''
+    measure = hasattr(sys, 'getsizeof')
+    seen = set()
+    released = {}
+    for entity in entities:
+        if not hasattr(entity, '_setup_done'):
+            continue
+        desc = entity._descriptor
+        state = [desc.builders, desc._columns, desc.constraints,
+                 desc.properties, desc.relationships,
+                 entity.__dict__.get(MUTATORS)]
+        if measure:
+            released[entity.__name__] = state_size(state, seen)
+        else:
+            released[entity.__name__] = None
+
+        desc.builders = []
+        desc.builders_done = 0
+        desc._columns = ColumnCollection()
+        desc.constraints = []
+        desc.properties = {}
+        desc.relationships = []
+        if MUTATORS in entity.__dict__:
+            delattr(entity, MUTATORS)
+        setup_registry.discard_changed(entity)
+    return released
 
 
 def cleanup_entities(entities):
@@ -840,10 +1911,21 @@ def cleanup_entities(entities):
         if hasattr(entity, '_setup_done'):
             del entity._setup_done
 
+        if isinstance(entity.__dict__.get('query'), LazySetupTrigger):
+            del entity.query
+
         entity.table = None
         entity.mapper = None
 
         desc._pk_col_done = False
+        desc._serializers = {}
+        desc._snapshot_class = None
+        if desc.query_cache is not None:
+            desc.query_cache.clear()
+        if desc.pk_cache is not None:
+            desc.pk_cache.clear()
+        desc.builders_done = 0
+        setup_registry.forget(entity)
         desc.has_pk = False
         desc._columns = ColumnCollection()
         desc.constraints = []
@@ -873,6 +1955,115 @@ class EntityBase(object):
         for key, value in kwargs.iteritems():
             setattr(self, key, value)
 
+    @classmethod
+    def _fetch_by_pks(cls, pk_tuples, pk_props=None, load=True):
+        '''
+        Return a dictionary of the instances of the entity corresponding to
+        the primary key tuples passed as argument, keyed on those tuples.
+        Like `query.get`, instances already present in the session are taken
+        from its identity map, and the others are loaded using a single
+        query (unless `load` is False). Keys which do not correspond to any
+        instance are not included. The values of the tuples correspond to
+        `pk_props`, which defaults to the primary key properties of the
+        entity.
+        '''
+        if pk_props is None:
+            pk_props = cls._descriptor.primary_key_properties
+        session = cls.query.session
+        mapper = cls.mapper
+        result = {}
+        missing = set()
+        for pk_tuple in pk_tuples:
+            key = mapper.identity_key_from_primary_key(list(pk_tuple))
+            instance = session.identity_map.get(key)
+            if instance is not None and isinstance(instance, cls):
+                result[pk_tuple] = instance
+            else:
+                missing.add(pk_tuple)
+        pk_tuples = list(missing)
+        if not pk_tuples or not load:
+            return result
+        condition = primary_key_condition([getattr(cls, prop.key)
+                                           for prop in pk_props], pk_tuples)
+        for instance in cls.query.filter(condition):
+            pk_tuple = tuple([getattr(instance, prop.key)
+                              for prop in pk_props])
+            result[pk_tuple] = instance
+        return result
+
+    @classmethod
+    def bulk_upsert(cls, rows, batch_size=1000):
+        '''
+        Update or create the instances corresponding to a list of dictionaries
+        (as accepted by `from_dict`) which contain the primary key of the
+        instances, as do their nested rows. Existing instances are fetched
+        using one query per batch of `batch_size` rows (instead of one query
+        per row), updated or created, and the session is flushed after each
+        batch. Returns the number of rows processed.
+        '''
+        session = cls.query.session
+        count = 0
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            cls._update_or_create_many(batch, surrogate=False)
+            session.flush()
+            count += len(batch)
+        return count
+
+    @classmethod
+    def bulk_insert(cls, rows, return_defaults=False, batch_size=1000):
+        '''
+        Insert the rows described by a list of dictionaries of column
+        property values (keyed on property names) directly into the table(s)
+        of the entity, bypassing the session unit of work: no instance is
+        created, and rows are inserted using one "executemany" statement per
+        table and batch of `batch_size` rows. Returns the number of rows
+        inserted.
+
+        The values Elixir would otherwise generate are still set: database
+        defaults (including automatic primary keys), the polymorphic
+        identity of the entity, the initial value of its `version_id_col`,
+        and the values set by the mapper extensions of the entity which
+        provide a `before_bulk_insert(entity, rows)` method, called once per
+        batch (this is the case for the `acts_as_versioned` and
+        `acts_as_encrypted` extensions). Entities with other insert hooks
+        (including `before_insert` and `after_insert` event methods) cannot
+        be inserted this way.
+
+        If `return_defaults` is True, the primary key values generated by
+        the database are set in the dictionaries passed as argument. This
+        requires executing one statement per row for the tables with an
+        automatic primary key, as does inserting rows of an entity using
+        "multi" inheritance without giving their primary key.
+        '''
+        extensions = bulk_insert_extensions(cls)
+        tables = inheritance_tables(cls.mapper)
+        session = cls.query.session
+        # pending changes need to reach the database before the rows which
+        # could reference them
+        session.flush()
+
+        count = 0
+        for start in range(0, len(rows), batch_size):
+            batch = [dict(row) for row in rows[start:start + batch_size]]
+            for ext in extensions:
+                ext.before_bulk_insert(cls, batch)
+            values = [column_values(cls.mapper, row) for row in batch]
+            for num, table in enumerate(tables):
+                need_pk = return_defaults or num < len(tables) - 1
+                insert_table_rows(session, cls.mapper, table, values, need_pk)
+            if return_defaults:
+                for row, row_values in zip(rows[start:start + batch_size],
+                                           values):
+                    for prop in cls._descriptor.primary_key_properties:
+                        for col in prop.columns:
+                            if col in row_values:
+                                row[prop.key] = row_values[col]
+                                break
+            count += len(batch)
+        clear_query_caches(cls)
+        return count
+
     @classmethod
     def update_or_create(cls, data, surrogate=True):
         pk_props = cls._descriptor.primary_key_properties
@@ -891,19 +2082,78 @@ class EntityBase(object):
                 record = cls()
             else:
                 raise Exception("Cannot create non surrogate without pk")
-        record.from_dict(data)
+        record.from_dict(data, not surrogate)
         return record
 
-    def from_dict(self, data):
+    @classmethod
+    def _update_or_create_many(cls, rows, surrogate=True, create_missing=None,
+                               prefetched=False):
+        '''
+        Same as calling `update_or_create` on each of the rows passed as
+        argument, but fetching all existing instances (including those of
+        the nested rows, level by level) in one query per entity and level.
+        Returns the list of the updated or created instances.
+
+        Rows whose primary key does not correspond to an existing instance
+        are created if `create_missing` is True (it defaults to the opposite
+        of `surrogate`). If `prefetched` is True, the existing instances were
+        already loaded into the session (by `prefetch_nested_rows`).
+        '''
+        if create_missing is None:
+            create_missing = not surrogate
+        pk_props = cls._descriptor.primary_key_properties
+        pk_tuples = []
+        for row in rows:
+            # if all pk are present and not None
+            if not [1 for p in pk_props if row.get(p.key) is None]:
+                pk_tuples.append(tuple([row[prop.key] for prop in pk_props]))
+            elif surrogate:
+                pk_tuples.append(None)
+            else:
+                raise Exception("Cannot create non surrogate without pk")
+
+        existing = cls._fetch_by_pks([pk_tuple for pk_tuple in pk_tuples
+                                      if pk_tuple is not None],
+                                     load=not prefetched)
+        if not prefetched:
+            # keep the prefetched instances referenced, since the identity
+            # map of the session only holds weak references to them.
+            fetched = prefetch_nested_rows(cls, rows)
+
+        records = []
+        for row, pk_tuple in zip(rows, pk_tuples):
+            if pk_tuple is None:
+                record = cls()
+            else:
+                record = existing.get(pk_tuple)
+                if record is None:
+                    if not create_missing:
+                        raise Exception("Cannot create surrogate with pk")
+                    # rows with the same pk update the same new record
+                    record = existing[pk_tuple] = cls()
+            record._set_dict(row, create_missing)
+            records.append(record)
+        return records
+
+    def from_dict(self, data, create_missing=False):
         """
         Update a mapped class with data from a JSON-style nested dict/list
-        structure.
+        structure. Nested rows without primary key are created, and nested
+        rows with a primary key update the corresponding instance, which is
+        created if it does not exist and `create_missing` is True.
         """
         # surrogate can be guessed from autoincrement/sequence but I guess
         # that's not 100% reliable, so we'll need an override
 
         mapper = sqlalchemy.orm.object_mapper(self)
+        # load the existing instances of nested rows up front, one query per
+        # entity and nesting level, rather than one query per row (they are
+        # kept referenced until the data is applied).
+        fetched = prefetch_nested_rows(mapper.class_, [data])
+        self._set_dict(data, create_missing)
 
+    def _set_dict(self, data, create_missing):
+        mapper = sqlalchemy.orm.object_mapper(self)
         for key, value in data.iteritems():
             if isinstance(value, dict):
                 dbvalue = getattr(self, key)
@@ -914,44 +2164,126 @@ class EntityBase(object):
                 # already has a value, update that record.
                 if not [1 for p in pk_props if p.key in data] and \
                    dbvalue is not None:
-                    dbvalue.from_dict(value)
+                    dbvalue._set_dict(value, create_missing)
                 else:
-                    record = rel_class.update_or_create(value)
+                    record = rel_class._update_or_create_many(
+                                 [value], True, create_missing, True)[0]
                     setattr(self, key, record)
             elif isinstance(value, list) and \
                  value and isinstance(value[0], dict):
 
                 rel_class = mapper.get_property(key).mapper.class_
-                new_attr_value = []
                 for row in value:
                     if not isinstance(row, dict):
                         raise Exception(
                                 'Cannot send mixed (dict/non dict) data '
                                 'to list relationships in from_dict data.')
-                    record = rel_class.update_or_create(row)
-                    new_attr_value.append(record)
-                setattr(self, key, new_attr_value)
+                setattr(self, key,
+                        rel_class._update_or_create_many(
+                            value, True, create_missing, True))
             else:
                 setattr(self, key, value)
 
     def to_dict(self, deep={}, exclude=[]):
         """Generate a JSON-style nested dict/list structure from an object."""
-        col_prop_names = [p.key for p in self.mapper.iterate_properties \
-                                      if isinstance(p, ColumnProperty)]
-        data = dict([(name, getattr(self, name))
-                     for name in col_prop_names if name not in exclude])
-        for rname, rdeep in deep.iteritems():
-            dbdata = getattr(self, rname)
-            #FIXME: use attribute names (ie coltoprop) instead of column names
-            fks = self.mapper.get_property(rname).remote_side
-            exclude = [c.name for c in fks]
-            if dbdata is None:
-                data[rname] = None
-            elif isinstance(dbdata, list):
-                data[rname] = [o.to_dict(rdeep, exclude) for o in dbdata]
-            else:
-                data[rname] = dbdata.to_dict(rdeep, exclude)
-        return data
+        return self._descriptor.get_serializer(deep, exclude)(self)
+
+    @classmethod
+    def eager_options(cls, deep):
+        """
+        Return the query options needed to load all the relationships of a
+        to_dict `deep` specification in a fixed number of queries (one per
+        relationship, using the subquery loading strategy when available),
+        instead of one query per instance and relationship.
+
+        .. sourcecode:: python
+
+            deep = {'actors': {}, 'director': {'studio': {}}}
+            movies = Movie.query.options(*Movie.eager_options(deep))
+            data = [movie.to_dict(deep) for movie in movies]
+        """
+        return eager_load_options(deep)
+
+    @classmethod
+    def to_dicts(cls, instances, deep={}, exclude=[]):
+        """
+        Generate a list of JSON-style nested dict/list structures from a list
+        of objects (or a query), using the same serializer for all objects of
+        the same class. When given a query, the relationships in `deep` are
+        loaded eagerly (see `eager_options`).
+        """
+        if isinstance(instances, Query) and deep:
+            instances = instances.options(*eager_load_options(deep))
+        serializers = SerializerCache(deep, exclude)
+        return [serializers.get(instance.__class__)(instance)
+                for instance in instances]
+
+    @classmethod
+    def snapshots(cls, query=None):
+        """
+        Return read-only snapshots of the objects returned by `query` (or
+        of all the objects of the entity if no query is given). Snapshots
+        have an attribute for each column property of the entity, and are
+        built directly from the result rows: no instance is created nor
+        added to the session, which makes them much cheaper (in memory and
+        time) than instances when loading many objects for reporting.
+        Relationships are only available through their foreign key columns.
+
+        .. sourcecode:: python
+
+            for movie in Movie.snapshots(Movie.query.filter_by(year=1995)):
+                print movie.title, movie.director_id
+        """
+        if query is None:
+            query = cls.query
+        snapshot_class = cls._descriptor.get_snapshot_class()
+        columns = [getattr(cls, name) for name in snapshot_class.__slots__]
+        if hasattr(query, 'with_entities'):
+            rows = query.with_entities(*columns)
+        else:
+            # SQLAlchemy < 0.6.5
+            rows = query.values(*columns)
+        return [snapshot_class(*row) for row in rows]
+
+    @classmethod
+    def stream_dicts(cls, query=None, batch_size=1000, deep={}, exclude=[]):
+        """
+        Generate the JSON-style nested dict/list structures of all the
+        objects returned by `query` (or of all the objects of the entity if
+        no query is given), one at a time. The objects are loaded by batches
+        of `batch_size` in primary key order, and removed from the session
+        once serialized, so that memory usage does not depend on the number
+        of objects. The query should thus not be ordered or limited.
+        """
+        if query is None:
+            query = cls.query
+        serializers = SerializerCache(deep, exclude)
+        for batch in stream_batches(query, cls.mapper, batch_size,
+                                    deep):
+            for instance in batch:
+                yield serializers.get(instance.__class__)(instance)
+
+    @classmethod
+    def write_json_lines(cls, fileobj, query=None, batch_size=1000, deep={},
+                         exclude=[], default=unicode):
+        """
+        Write the objects returned by `query` (or all the objects of the
+        entity) to `fileobj` in the "JSON lines" format: one JSON document per
+        line (see `stream_dicts`). Values which JSON cannot represent, such as
+        dates, are converted using the `default` function. Returns the number
+        of objects written.
+        """
+        try:
+            import json
+        except ImportError:
+            import simplejson as json
+
+        count = 0
+        for data in cls.stream_dicts(query, batch_size, deep, exclude):
+            fileobj.write(json.dumps(data, default=default))
+            fileobj.write('\n')
+            count += 1
+        return count
 
     # session methods
     def flush(self, *args, **kwargs):
@@ -999,8 +2331,16 @@ class EntityBase(object):
         Returns the first instance of this class matching the given criteria.
         This is equivalent to:
         session.query(MyClass).filter_by(...).first()
+
+        The results are cached if the entity uses the ``query_cache``
+        option.
         """
-        return cls.query.filter_by(*args, **kwargs).first()
+        query = cls.query
+        cache = cls._descriptor.query_cache
+        if cache is not None and not args:
+            from elixir.cache import cached_get_by
+            return cached_get_by(cls, cache, kwargs)
+        return query.filter_by(*args, **kwargs).first()
 
     @classmethod
     def get(cls, *args, **kwargs):
@@ -1008,8 +2348,87 @@ class EntityBase(object):
         Return the instance of this class based on the given identifier,
         or None if not found. This is equivalent to:
         session.query(MyClass).get(...)
+
+        The instances are taken from a cache shared by all sessions if the
+        entity uses the ``pk_cache`` option.
+        """
+        query = cls.query
+        cache = cls._descriptor.pk_cache
+        if cache is not None and len(args) == 1 and not kwargs:
+            from elixir.cache import cached_get
+            return cached_get(cls, cache, args[0])
+        return query.get(*args, **kwargs)
+
+    @classmethod
+    def get_many(cls, ids, chunk_size=500):
+        """
+        Return the instances of this class corresponding to a list of
+        identifiers (primary key values, or tuples of values for composite
+        primary keys), in the same order, with None for the identifiers
+        which do not correspond to any instance. Instances already present
+        in the session are taken from it, and the others are loaded using
+        one query per chunk of `chunk_size` identifiers, instead of one
+        query per identifier.
+        """
+        mapper = cls.mapper
+        # the properties of the columns identifying instances (with "multi"
+        # inheritance, the primary key of the entity table is left out)
+        identity_cols = set(mapper.primary_key)
+        pk_props = [prop for prop in cls._descriptor.primary_key_properties
+                    if [col for col in prop.columns if col in identity_cols]]
+
+        pk_tuples = []
+        for ident in ids:
+            if isinstance(ident, (list, tuple)):
+                pk_tuples.append(tuple(ident))
+            else:
+                pk_tuples.append((ident,))
+
+        unique = []
+        seen = set()
+        for pk_tuple in pk_tuples:
+            if pk_tuple not in seen:
+                seen.add(pk_tuple)
+                unique.append(pk_tuple)
+
+        instances = {}
+        for start in range(0, len(unique), chunk_size):
+            chunk = unique[start:start + chunk_size]
+            instances.update(cls._fetch_by_pks(chunk, pk_props))
+        return [instances.get(pk_tuple) for pk_tuple in pk_tuples]
+
+    @classmethod
+    def delete_where(cls, *criteria):
+        """
+        Delete all the rows of this class matching the given criteria, using
+        a single DELETE statement (one per table for entities using "multi"
+        inheritance) instead of loading and deleting each instance. The
+        matching instances present in the session are expunged from it.
+        Returns the number of rows deleted.
+
+        .. sourcecode:: python
+
+            Session.delete_where(Session.expires < datetime.now())
+        """
+        return delete_where(cls, criteria)
+
+    @classmethod
+    def update_where(cls, criteria, values):
+        """
+        Update all the rows of this class matching the given criteria (a
+        single criterion or a list of criteria) with `values`, a dictionary
+        keyed on property names, using a single UPDATE statement (one per
+        table for entities using "multi" inheritance). The updated
+        attributes of the matching instances present in the session are
+        expired. Returns the number of rows updated.
+
+        .. sourcecode:: python
+
+            User.update_where(User.last_login < limit, {'active': False})
         """
-        return cls.query.get(*args, **kwargs)
+        if not isinstance(criteria, (list, tuple)):
+            criteria = [criteria]
+        return update_where(cls, criteria, values)
 
 
 class Entity(EntityBase):
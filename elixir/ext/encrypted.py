@@ -100,6 +100,14 @@ class ActsAsEncrypted(object):
                 perform_encryption(instance)
                 return EXT_CONTINUE
 
+            def before_bulk_insert(self, entity, rows):
+                for row in rows:
+                    for column_name in for_fields:
+                        current_value = row.get(column_name)
+                        if current_value:
+                            row[column_name] = encrypt_value(current_value,
+                                                             with_secret)
+
             if SA05orlater:
                 def reconstruct_instance(self, mapper, instance):
                     perform_decryption(instance)
@@ -0,0 +1,149 @@
+'''
+Schema-per-tenant support for Elixir.
+
+This extension allows to use one model, set up once, with several database
+schemas having the same structure (typically one schema per tenant). The
+entities are declared and set up as usual, without any schema, and each
+session is bound to the schema of a tenant when it is used. The tables and
+mappers are shared by all tenants, so the memory used and the time spent
+setting up the model do not depend on the number of tenants, and switching
+from a tenant to another is a constant time operation.
+
+.. sourcecode:: python
+
+    from elixir.ext.tenancy import set_tenant
+
+    class Movie(Entity):
+        title = Field(Unicode(30))
+
+    setup_all()
+
+    set_tenant(session, 'customer1')
+    Movie.query.all()               # SELECT ... FROM customer1.movie
+
+    set_tenant(session, 'customer2')
+    Movie.query.all()               # SELECT ... FROM customer2.movie
+
+Switching tenant closes the session (expunging all instances from it, since
+the same primary key can designate different rows in different schemas) and
+binds it to a connection dedicated to the new tenant. That connection is
+returned to the pool when switching to another tenant or when calling
+`clear_tenant`.
+
+The schema of the tenant is applied at execution time: with SQLAlchemy
+versions supporting it (1.1 and later), the `schema_translate_map` execution
+option of the connection is used, which works on all databases. With older
+versions, the connection search path is changed instead, which is only
+supported on PostgreSQL. Tables which were given an explicit schema are not
+affected in either case, so they can be used for data shared by all tenants.
+'''
+
+from sqlalchemy.orm import object_session
+
+__all__ = ['set_tenant', 'get_tenant', 'clear_tenant', 'tenant_connection']
+__doc_all__ = []
+
+try:
+    from sqlalchemy.engine import Connection
+    SCHEMA_TRANSLATION = hasattr(Connection, 'execution_options') and \
+                         hasattr(Connection, 'schema_for_object')
+except ImportError:
+    SCHEMA_TRANSLATION = False
+
+
+def tenant_connection(bind, schema):
+    '''
+    Return a new connection from `bind` (an engine or connection) on which
+    the unqualified tables are taken from the `schema` schema.
+    '''
+    conn = bind.connect()
+    if SCHEMA_TRANSLATION:
+        conn = conn.execution_options(schema_translate_map={None: schema})
+    else:
+        if conn.dialect.name not in ('postgres', 'postgresql'):
+            conn.close()
+            raise Exception("Schema-per-tenant mapping is only supported on "
+                            "PostgreSQL with this version of SQLAlchemy.")
+        preparer = conn.dialect.identifier_preparer
+        # SET is transactional on PostgreSQL, so it needs to be committed
+        # for a rollback of the session not to revert it.
+        execute_committed(conn, 'SET search_path TO %s, public'
+                                % preparer.quote_identifier(schema))
+    conn._elixir_tenant = schema
+    return conn
+
+
+def execute_committed(conn, statement):
+    trans = conn.begin()
+    try:
+        conn.execute(statement)
+    except:
+        trans.rollback()
+        raise
+    trans.commit()
+
+
+def release_connection(conn):
+    '''
+    Close a connection returned by `tenant_connection`, resetting its search
+    path first if needed so that the underlying DBAPI connection can be
+    reused safely by the pool.
+    '''
+    if not SCHEMA_TRANSLATION:
+        execute_committed(conn, 'RESET search_path')
+    conn.close()
+
+
+def set_tenant(session, schema, bind=None):
+    '''
+    Bind `session` (which can be a scoped session) to the `schema` schema.
+    The connection the session was previously bound to for another tenant (if
+    any) is closed. The engine to use is taken from the `bind` argument if
+    given, otherwise from the current bind of the session or, failing that,
+    from the default metadata.
+    '''
+    current = session.bind
+    if bind is None:
+        if current is not None:
+            bind = current.engine
+        else:
+            import elixir
+            bind = elixir.metadata.bind
+    if bind is None:
+        raise Exception("No engine available to bind the session to the "
+                        "'%s' tenant." % schema)
+
+    session.close()
+    if get_tenant(session) is not None:
+        previous_bind = current._elixir_previous_bind
+        release_connection(current)
+    else:
+        previous_bind = current
+    conn = tenant_connection(bind, schema)
+    conn._elixir_previous_bind = previous_bind
+    session.bind = conn
+
+
+def clear_tenant(session):
+    '''
+    Close `session` and bind it back to what it was bound to before
+    `set_tenant` was called on it, releasing the connection of the tenant.
+    '''
+    current = session.bind
+    session.close()
+    if get_tenant(session) is not None:
+        session.bind = current._elixir_previous_bind
+        release_connection(current)
+
+
+def get_tenant(session_or_instance):
+    '''
+    Return the schema of the tenant a session (or the session of an
+    instance) is bound to, or None if it is not bound to a tenant.
+    '''
+    session = session_or_instance
+    if not hasattr(session, 'bind'):
+        session = object_session(session_or_instance)
+        if session is None:
+            return None
+    return getattr(session.bind, '_elixir_tenant', None)
@@ -46,7 +46,6 @@ values within the entity's main table will be versioned into the history table.
 '''
 
 from datetime              import datetime
-import inspect
 
 from sqlalchemy            import Table, Column, and_, desc
 from sqlalchemy.orm        import mapper, MapperExtension, EXT_CONTINUE, \
@@ -55,7 +54,6 @@ from sqlalchemy.orm        import mapper, MapperExtension, EXT_CONTINUE, \
 from elixir                import Integer, DateTime
 from elixir.statements     import Statement
 from elixir.properties     import EntityBuilder
-from elixir.entity         import getmembers
 
 __all__ = ['acts_as_versioned', 'after_revert']
 __doc_all__ = []
@@ -94,6 +92,14 @@ class VersionedMapperExtension(MapperExtension):
         setattr(instance, timestamp_colname, datetime.now())
         return EXT_CONTINUE
 
+    def before_bulk_insert(self, entity, rows):
+        version_colname, timestamp_colname = \
+            entity.__versioned_column_names__
+        now = datetime.now()
+        for row in rows:
+            row[version_colname] = 1
+            row[timestamp_colname] = now
+
     def before_update(self, mapper, connection, instance):
         old_values = instance.table.select(get_entity_where(instance)) \
                                    .execute().fetchone()
@@ -176,10 +182,8 @@ class VersionedEntityBuilder(EntityBuilder):
             entity.__versioned_column_names__
 
         # look for events
-        after_revert_events = []
-        for name, func in getmembers(entity, inspect.ismethod):
-            if getattr(func, '_elixir_after_revert', False):
-                after_revert_events.append(func)
+        after_revert_events = \
+            entity._descriptor.get_marked_methods('_elixir_after_revert')
 
         # create a history table for the entity
         skipped_columns = [version_colname]
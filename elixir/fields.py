@@ -105,9 +105,8 @@ Here is a quick example of how to use ``has_field``.
         has_field('id', Integer, primary_key=True)
         has_field('name', String(50))
 '''
-from sqlalchemy import Column
+from sqlalchemy import Column, ForeignKey, Constraint
 from sqlalchemy.orm import deferred, synonym
-from sqlalchemy.ext.associationproxy import association_proxy
 
 from elixir.statements import ClassMutator
 from elixir.properties import Property
@@ -139,6 +138,21 @@ class Field(Property):
         self.args = args
         self.kwargs = kwargs
 
+    def clone(self):
+        clone = super(Field, self).clone()
+        # Schema items (foreign keys, constraints) are bound to the column
+        # they are given to, so each copy needs its own. Sequences and
+        # defaults are left shared.
+        clone.args = tuple([self._copy_arg(arg) for arg in self.args])
+        clone.column = None
+        clone.property = None
+        return clone
+
+    def _copy_arg(self, arg):
+        if isinstance(arg, (ForeignKey, Constraint)):
+            return arg.copy()
+        return arg
+
     def attach(self, entity, name):
         # If no colname was defined (through the 'colname' kwarg), set
         # it to the name of the attr.
@@ -165,10 +179,11 @@ class Field(Property):
             if isinstance(self.deferred, basestring):
                 group = self.deferred
             self.property = deferred(self.column, group=group)
-        elif self.name != self.colname:
-            # if the property name is different from the column name, we need
-            # to add an explicit property (otherwise nothing is needed as it's
-            # done automatically by SA)
+        elif self.name != self.colname or hasattr(self.entity, '_setup_done'):
+            # if the property name is different from the column name, or if
+            # the column was added to the table of an entity which is already
+            # mapped, we need to add an explicit property (otherwise nothing
+            # is needed as it's done automatically by SA)
             self.property = self.column
 
         if self.property is not None:
@@ -180,6 +195,7 @@ class Field(Property):
 
 def has_field_handler(entity, name, *args, **kwargs):
     if 'through' in kwargs:
+        from sqlalchemy.ext.associationproxy import association_proxy
         setattr(entity, name,
                 association_proxy(kwargs.pop('through'),
                                   kwargs.pop('attribute', name),
@@ -131,6 +131,20 @@ The list of supported arguments are as follows:
 |                     | check. Use with care as it is easy to shoot oneself   |
 |                     | in the foot when overriding columns.                  |
 +---------------------+-------------------------------------------------------+
+| ``query_cache``     | Cache the results of the ``get_by`` class method of   |
+|                     | the entity. It can be given as ``True``, as the       |
+|                     | maximum number of cached results, as a dictionary of  |
+|                     | arguments (``size`` and ``ttl``) or as a              |
+|                     | ``QueryCache`` instance. See the ``elixir.cache``     |
+|                     | module for details. Defaults to ``None``.             |
++---------------------+-------------------------------------------------------+
+| ``pk_cache``        | Cache the column values of the instances returned by  |
+|                     | the ``get`` class method of the entity in a cache     |
+|                     | shared by all sessions. It takes the same values as   |
+|                     | the ``query_cache`` option. This is meant for         |
+|                     | entities which are rarely modified. Defaults to       |
+|                     | ``None``.                                             |
++---------------------+-------------------------------------------------------+
 
 For examples, please refer to the examples and unit tests.
 
@@ -226,6 +240,8 @@ options_defaults = dict(
     allowcoloverride=False,
     order_by=None,
     resolve_root=None,
+    query_cache=None,
+    pk_cache=None,
     mapper_options={},
     table_options={}
 )
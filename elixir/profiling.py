@@ -0,0 +1,198 @@
+'''
+Profiling of the setup phase of entities.
+
+When setup is slow, it is often hard to tell which entity or which builder is
+responsible. When profiling is enabled, the wall time spent and the number of
+allocations in each setup phase of each entity, and in each builder called
+during that phase, are recorded.
+
+.. sourcecode:: python
+
+    setup_all(profile=True)
+
+    report = setup_report()
+    print report.summary()
+
+    # structured data
+    report.phases       # {phase name: stats}
+    report.entities     # {entity name: stats}
+    report.builders     # {builder class name: stats}
+
+Each "stats" value is a dictionary with the following keys: ``calls``,
+``time`` (the total wall time, in seconds), ``self_time`` (the wall time
+minus the time spent in nested profiled calls, for example the setup of the
+target of a ManyToOne relationship) and ``allocations`` (the net number of
+allocated memory blocks when the interpreter can report it cheaply, that is
+on Python 3.4 and later, or None otherwise).
+
+On older interpreters, the net number of objects tracked by the garbage
+collector can be counted instead by using ``setup_all(profile='allocations')``.
+Counting them walks the whole heap twice per recorded call though, which
+makes profiling a large model very slow, and inflates the times reported.
+
+Profiling can also be enabled for a longer period (for example to include
+entities set up lazily) by using the `start` and `stop` functions of this
+module.
+'''
+
+import gc
+import sys
+import time
+
+__doc_all__ = []
+
+# the active profiler, if any
+profiler = None
+
+# the report of the last profiling run
+last_report = None
+
+def no_allocations():
+    return None
+
+
+def tracked_objects():
+    return len(gc.get_objects())
+
+
+def allocation_counter(count_objects=False):
+    '''
+    Return a function returning the current number of allocated memory
+    blocks, or None if it cannot be measured cheaply. If `count_objects` is
+    True and the number of allocated blocks is not available, the function
+    returns the number of objects tracked by the garbage collector, which
+    needs to walk the whole heap.
+    '''
+    if hasattr(sys, 'getallocatedblocks'):
+        return sys.getallocatedblocks
+    elif count_objects and hasattr(gc, 'get_objects'):
+        return tracked_objects
+    else:
+        return no_allocations
+
+
+class SetupProfiler(object):
+    def __init__(self, count_objects=False):
+        self.allocated_blocks = allocation_counter(count_objects)
+        # list of (phase, entity name, builder class name or None, time,
+        # self time, allocations) tuples
+        self.records = []
+        # stack of the time spent in nested calls for the calls in progress
+        self.stack = []
+
+    def call(self, phase, entity, builder, func):
+        self.stack.append(0.0)
+        start_blocks = self.allocated_blocks()
+        start = time.time()
+        try:
+            return func()
+        finally:
+            duration = time.time() - start
+            end_blocks = self.allocated_blocks()
+            nested = self.stack.pop()
+            if self.stack:
+                self.stack[-1] += duration
+            if start_blocks is not None:
+                allocations = end_blocks - start_blocks
+            else:
+                allocations = None
+            if builder is not None:
+                builder = builder.__class__.__name__
+            self.records.append((phase, entity.__name__, builder, duration,
+                                 duration - nested, allocations))
+
+    def report(self):
+        return SetupReport(self.records)
+
+
+class SetupReport(object):
+    '''
+    Results of a profiling run of the setup phase.
+    '''
+
+    def __init__(self, records):
+        self.records = records
+        self.phases = {}
+        self.entities = {}
+        self.builders = {}
+        for phase, entity, builder, duration, self_time, allocations \
+                in records:
+            if builder is None:
+                # the setup phase methods of the entity descriptors
+                self._add(self.phases, phase, duration, self_time,
+                          allocations)
+                self._add(self.entities, entity, duration, self_time,
+                          allocations)
+            else:
+                self._add(self.builders, builder, duration, self_time,
+                          allocations)
+
+    def _add(self, stats, key, duration, self_time, allocations):
+        if key not in stats:
+            stats[key] = {'calls': 0, 'time': 0.0, 'self_time': 0.0,
+                          'allocations': None}
+        item = stats[key]
+        item['calls'] += 1
+        item['time'] += duration
+        item['self_time'] += self_time
+        if allocations is not None:
+            item['allocations'] = (item['allocations'] or 0) + allocations
+
+    def summary(self, limit=10):
+        '''
+        Return a text summary of the report, listing the `limit` slowest
+        phases, entities and builders, sorted by decreasing self time.
+        '''
+        lines = []
+        for title, stats in (('phase', self.phases),
+                             ('entity', self.entities),
+                             ('builder', self.builders)):
+            lines.append('%-40s %6s %10s %10s %12s'
+                         % (title, 'calls', 'time', 'self', 'allocations'))
+            items = sorted(stats.items(),
+                           key=lambda item: item[1]['self_time'],
+                           reverse=True)
+            for key, item in items[:limit]:
+                allocations = item['allocations']
+                if allocations is None:
+                    allocations = 'n/a'
+                lines.append('%-40s %6d %10.4f %10.4f %12s'
+                             % (key, item['calls'], item['time'],
+                                item['self_time'], allocations))
+            lines.append('')
+        return '\n'.join(lines)
+
+    def __str__(self):
+        return self.summary()
+
+
+def start(count_objects=False):
+    '''
+    Start recording the setup of entities. If `count_objects` is True, the
+    objects tracked by the garbage collector are counted when the number of
+    allocated memory blocks is not available (see above).
+    '''
+    global profiler
+    profiler = SetupProfiler(count_objects)
+
+
+def stop():
+    '''
+    Stop recording the setup of entities, and return the corresponding
+    report.
+    '''
+    global profiler, last_report
+    if profiler is not None:
+        last_report = profiler.report()
+        profiler = None
+    return last_report
+
+
+def setup_report():
+    '''
+    Return the report of the last profiling run of the setup phase (or of the
+    current one, if profiling is still active).
+    '''
+    if profiler is not None:
+        return profiler.report()
+    return last_report
@@ -30,8 +30,11 @@ Here is a quick example of how to use ``has_property``.
                          (c.quantity * c.unit_price).label('price')))
 '''
 
+import copy
+
 from elixir.statements import PropertyStatement
 from sqlalchemy.orm import column_property, synonym
+from sqlalchemy.orm.interfaces import MapperProperty
 
 __doc_all__ = ['EntityBuilder', 'Property', 'GenericProperty',
                'ColumnProperty']
@@ -126,6 +129,27 @@ class Property(EntityBuilder):
         # register this property as a builder
         entity._descriptor.builders.append(self)
 
+    def clone(self):
+        '''
+        Return a copy of this property, used when a property declared on an
+        abstract base class is inherited by a concrete entity. Only the
+        declarative state of the property is copied: its containers (lists
+        and dictionaries of arguments) are copied, but the objects they
+        contain (types, defaults, callables, ...) are shared with the
+        original. The copy keeps the declaration order of the original.
+        '''
+        clone = self.__class__.__new__(self.__class__)
+        state = self.__dict__.copy()
+        for key, value in state.iteritems():
+            if isinstance(value, dict):
+                state[key] = value.copy()
+            elif isinstance(value, list):
+                state[key] = value[:]
+        clone.__dict__ = state
+        clone.entity = None
+        clone.name = None
+        return clone
+
     def __repr__(self):
         return "Property(%s, %s)" % (self.name, self.entity)
 
@@ -150,6 +174,14 @@ class GenericProperty(Property):
         self.args = args
         self.kwargs = kwargs
 
+    def clone(self):
+        clone = super(GenericProperty, self).clone()
+        # a prebuilt SQLAlchemy property is bound to the mapper it is added
+        # to, so each copy needs its own.
+        if isinstance(self.prop, MapperProperty):
+            clone.prop = copy.copy(self.prop)
+        return clone
+
     def create_properties(self):
         if hasattr(self.prop, '__call__'):
             prop_value = self.prop(self.entity.table.c)
@@ -0,0 +1,472 @@
+'''
+Bulk reflection of the tables of autoloaded entities.
+
+By default, the table of each entity using the ``autoload`` option is
+reflected on its own when that entity is set up, which checks out a
+connection for each table. When the database is remote and the model is
+large, those round trips can dominate the setup time. The functions in this
+module reflect the tables of all autoloaded entities up front instead, grouped
+per metadata and schema, using a single connection (and, on SQLAlchemy 0.6
+and later, a single inspector caching catalog lookups) for each group, or
+optionally a pool of threads each using their own connection and inspector.
+
+This is usually used through the `reflect` argument of `setup_all`:
+
+.. sourcecode:: python
+
+    # one pass per schema, using a single connection
+    setup_all(reflect=True)
+
+    # reflect tables concurrently, using 8 threads
+    setup_all(reflect=8)
+
+The time spent reflecting each table (in seconds) is available in the
+`timings` dictionary of this module, keyed on the full name of the tables.
+
+Reflected tables can also be stored in a local cache file, so that they do
+not need to be reflected again as long as the database schema does not
+change. The validity of the cached tables is checked using a cheap
+"fingerprint" of the schema: either the result of a query given by the user
+(typically reading a schema version number maintained by migrations), or a
+checksum of the database catalog.
+
+.. sourcecode:: python
+
+    setup_all(reflection_cache='/var/cache/myapp/reflection.cache')
+
+    cache = ReflectionCache('/var/cache/myapp/reflection.cache',
+                            fingerprint='SELECT version FROM schema_version')
+    setup_all(reflection_cache=cache)
+
+The `fingerprint` argument can also be a callable taking a connection and a
+schema name as arguments and returning any picklable value.
+'''
+
+import os
+import time
+import threading
+import Queue
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1
+
+import sqlalchemy
+from sqlalchemy import MetaData, Table
+
+__doc_all__ = []
+
+# time spent reflecting each table during the last reflection run
+timings = {}
+
+
+def load_pickle(path, default=None):
+    '''
+    Return the object pickled in the file at `path`, or `default` if that
+    file does not exist or cannot be unpickled.
+    '''
+    try:
+        f = open(path, 'rb')
+    except IOError:
+        return default
+    try:
+        try:
+            return pickle.load(f)
+        except Exception:
+            # a corrupt or incompatible file is simply a miss
+            return default
+    finally:
+        f.close()
+
+
+def save_pickle(path, data):
+    '''
+    Pickle `data` to the file at `path`, replacing it atomically so that
+    concurrent readers never see a partially written file.
+    '''
+    tmp_path = '%s.tmp' % path
+    f = open(tmp_path, 'wb')
+    try:
+        pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+    finally:
+        f.close()
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        # on Windows, rename does not overwrite existing files
+        os.remove(path)
+        os.rename(tmp_path, path)
+
+
+def autoloaded_tables(entities):
+    '''
+    Return a dictionary of the tables which can be reflected ahead of time for
+    the entities passed as argument, keyed on (metadata, schema) pairs.
+
+    Entities which override reflected columns or pass other options to their
+    table are left out: they are reflected on their own, as usual.
+    '''
+    groups = {}
+    for entity in entities:
+        desc = entity._descriptor
+        if hasattr(entity, '_setup_done') or not desc.autoload or \
+           desc.table_args:
+            continue
+        if [key for key in desc.table_options if key != 'schema']:
+            continue
+        schema = desc.table_options.get('schema', None)
+        names = groups.setdefault((desc.metadata, schema), [])
+        names.append(desc.tablename)
+
+        # ManyToMany tables of autoloaded entities are autoloaded too, but
+        # their name is only known up front when it was given explicitly.
+        for rel in desc.relationships:
+            tablename = getattr(rel, 'user_tablename', None)
+            if not tablename or rel.table is not None:
+                continue
+            if [key for key in rel.table_kwargs if key != 'schema']:
+                continue
+            m2m_schema = rel.table_kwargs.get('schema', None)
+            names = groups.setdefault((desc.metadata, m2m_schema), [])
+            if tablename not in names:
+                names.append(tablename)
+    return groups
+
+
+def reflect_tables(metadata, names, schema=None, bind=None, threads=None):
+    '''
+    Reflect the tables named in `names` (and the tables they reference) into
+    `metadata`. Tables which are already present in the metadata are skipped.
+
+    If `threads` is given, the tables are reflected concurrently using that
+    number of threads, each using its own connection from the engine pool.
+
+    Returns a dictionary of the time spent reflecting each table.
+    '''
+    if bind is None:
+        bind = metadata.bind
+    if schema is not None:
+        fullnames = ['%s.%s' % (schema, name) for name in names]
+    else:
+        fullnames = names
+    names = [name for name, fullname in zip(names, fullnames)
+             if fullname not in metadata.tables]
+    if not names:
+        return {}
+
+    if threads:
+        return _reflect_concurrently(metadata, names, schema, bind, threads)
+
+    if bind.engine is not bind:
+        conn = bind
+        close = False
+    else:
+        conn = bind.contextual_connect()
+        close = True
+
+    result = {}
+    try:
+        reflect = table_reflector(conn)
+        for name in names:
+            start = time.time()
+            reflect(name, metadata, schema)
+            result[name] = time.time() - start
+    finally:
+        if close:
+            conn.close()
+    return result
+
+
+def table_reflector(conn):
+    '''
+    Return a function reflecting a table, given its name, metadata and
+    schema, using `conn`. On SQLAlchemy 0.6 and later, all the tables
+    reflected by that function share a single inspector, so that the catalog
+    lookups the dialect caches in it (the list of tables, the identifiers of
+    tables, ...) are only done once per connection instead of once per table.
+    '''
+    try:
+        from sqlalchemy.engine.reflection import Inspector
+    except ImportError:
+        # SQLAlchemy < 0.6
+        Inspector = None
+    if Inspector is None:
+        def reflect(name, metadata, schema):
+            return Table(name, metadata, schema=schema, autoload=True,
+                         autoload_with=conn)
+        return reflect
+
+    inspector = Inspector.from_engine(conn)
+
+    def reflect(name, metadata, schema):
+        if schema is not None:
+            key = '%s.%s' % (schema, name)
+        else:
+            key = name
+        # the table could have been reflected already, as the target of a
+        # foreign key of another table
+        if key in metadata.tables:
+            return metadata.tables[key]
+        table = Table(name, metadata, schema=schema)
+        try:
+            inspector.reflecttable(table, None)
+        except:
+            # do not leave an empty table behind, as autoload does
+            metadata.remove(table)
+            raise
+        return table
+    return reflect
+
+
+def _reflect_concurrently(metadata, names, schema, bind, threads):
+    queue = Queue.Queue()
+    for name in names:
+        queue.put(name)
+
+    result = {}
+    errors = []
+    # Each worker reflects into its own metadata, since MetaData objects are
+    # not thread-safe. The tables are copied into the target metadata once
+    # all workers are done.
+    worker_metadatas = []
+
+    def worker():
+        worker_metadata = MetaData()
+        worker_metadatas.append(worker_metadata)
+        conn = bind.engine.connect()
+        try:
+            reflect = table_reflector(conn)
+            while True:
+                try:
+                    name = queue.get_nowait()
+                except Queue.Empty:
+                    break
+                start = time.time()
+                try:
+                    reflect(name, worker_metadata, schema)
+                except Exception, e:
+                    errors.append(e)
+                    break
+                result[name] = time.time() - start
+        finally:
+            conn.close()
+
+    workers = [threading.Thread(target=worker)
+               for num in range(min(threads, len(names)))]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+
+    for worker_metadata in worker_metadatas:
+        for key, table in worker_metadata.tables.items():
+            if key not in metadata.tables:
+                table.tometadata(metadata)
+    return result
+
+
+def reflect_autoloaded_tables(entities, threads=None):
+    '''
+    Reflect the tables of all autoloaded entities in the list passed as
+    argument, one group (per metadata and schema) at a time. Entities whose
+    metadata is not bound to an engine are skipped.
+
+    Returns a dictionary of the time spent reflecting each table, keyed on
+    the full name of the tables. The same information is also stored in the
+    `timings` attribute of this module.
+    '''
+    timings.clear()
+    for (metadata, schema), names in autoloaded_tables(entities).iteritems():
+        if metadata.bind is None:
+            continue
+        group_timings = reflect_tables(metadata, names, schema,
+                                       threads=threads)
+        for name, duration in group_timings.iteritems():
+            if schema is not None:
+                name = '%s.%s' % (schema, name)
+            timings[name] = duration
+    return dict(timings)
+
+
+# Queries returning a summary of the database catalog, used to compute the
+# default schema fingerprint. On databases where the full definition of the
+# tables is not available in the catalog, the columns, constraints (including
+# foreign keys) and indexes are covered.
+CATALOG_QUERIES = {
+    'sqlite': ["SELECT type, name, tbl_name, sql FROM sqlite_master "
+               "ORDER BY type, name"],
+    'postgres': ["SELECT table_schema, table_name, column_name, data_type, "
+                 "is_nullable, column_default "
+                 "FROM information_schema.columns "
+                 "ORDER BY table_schema, table_name, ordinal_position",
+                 "SELECT constraint_schema, constraint_name, table_name, "
+                 "constraint_type "
+                 "FROM information_schema.table_constraints "
+                 "ORDER BY constraint_schema, table_name, constraint_name",
+                 "SELECT constraint_schema, constraint_name, table_name, "
+                 "column_name, ordinal_position "
+                 "FROM information_schema.key_column_usage "
+                 "ORDER BY constraint_schema, table_name, constraint_name, "
+                 "ordinal_position",
+                 "SELECT constraint_schema, constraint_name, "
+                 "unique_constraint_schema, unique_constraint_name, "
+                 "update_rule, delete_rule "
+                 "FROM information_schema.referential_constraints "
+                 "ORDER BY constraint_schema, constraint_name",
+                 "SELECT schemaname, tablename, indexname, indexdef "
+                 "FROM pg_indexes "
+                 "ORDER BY schemaname, tablename, indexname"],
+    'mysql': ["SELECT table_schema, table_name, column_name, column_type, "
+              "is_nullable, column_default, column_key "
+              "FROM information_schema.columns "
+              "WHERE table_schema = DATABASE() "
+              "ORDER BY table_name, ordinal_position",
+              "SELECT constraint_name, table_name, constraint_type "
+              "FROM information_schema.table_constraints "
+              "WHERE table_schema = DATABASE() "
+              "ORDER BY table_name, constraint_name",
+              "SELECT constraint_name, table_name, column_name, "
+              "ordinal_position, referenced_table_schema, "
+              "referenced_table_name, referenced_column_name "
+              "FROM information_schema.key_column_usage "
+              "WHERE table_schema = DATABASE() "
+              "ORDER BY table_name, constraint_name, ordinal_position",
+              "SELECT constraint_name, table_name, unique_constraint_name, "
+              "update_rule, delete_rule "
+              "FROM information_schema.referential_constraints "
+              "WHERE constraint_schema = DATABASE() "
+              "ORDER BY table_name, constraint_name",
+              "SELECT table_name, index_name, non_unique, seq_in_index, "
+              "column_name "
+              "FROM information_schema.statistics "
+              "WHERE table_schema = DATABASE() "
+              "ORDER BY table_name, index_name, seq_in_index"],
+}
+CATALOG_QUERIES['postgresql'] = CATALOG_QUERIES['postgres']
+
+
+def catalog_fingerprint(conn, schema=None):
+    '''
+    Compute a checksum of the database catalog, using the queries
+    corresponding to the dialect of the connection in `CATALOG_QUERIES`.
+    '''
+    dialect_name = conn.dialect.name
+    if dialect_name not in CATALOG_QUERIES:
+        raise Exception("No catalog query is known for the '%s' dialect. "
+                        "You need to provide a fingerprint query or "
+                        "function to the reflection cache." % dialect_name)
+    digest = sha1()
+    for query in CATALOG_QUERIES[dialect_name]:
+        digest.update(query)
+        for row in conn.execute(query):
+            digest.update(repr(tuple(row)))
+    return digest.hexdigest()
+
+
+class ReflectionCache(object):
+    '''
+    A file storing the tables reflected for autoloaded entities, invalidated
+    whenever the fingerprint of the database schema changes.
+    '''
+
+    def __init__(self, path, fingerprint=None):
+        self.path = path
+        self.fingerprint = fingerprint
+        # the names of the tables which were loaded from the cache, and of
+        # those which had to be reflected during the last run
+        self.hits = []
+        self.misses = []
+
+    def compute_fingerprint(self, conn, schema):
+        if self.fingerprint is None:
+            return catalog_fingerprint(conn, schema)
+        elif hasattr(self.fingerprint, '__call__'):
+            return self.fingerprint(conn, schema)
+        else:
+            return tuple(conn.execute(self.fingerprint).fetchone())
+
+    def load(self):
+        return load_pickle(self.path, {})
+
+    def save(self, data):
+        save_pickle(self.path, data)
+
+    def reflect_autoloaded_tables(self, entities, threads=None):
+        '''
+        Load the tables of all autoloaded entities in the list passed as
+        argument from the cache when it is valid, and reflect them (and
+        update the cache) otherwise.
+        '''
+        self.hits = []
+        self.misses = []
+        timings.clear()
+
+        data = self.load()
+        changed = False
+        for (metadata, schema), names in \
+                autoloaded_tables(entities).iteritems():
+            bind = metadata.bind
+            if bind is None:
+                continue
+            names = sorted(names)
+            # pickled tables can only be loaded by the SQLAlchemy version
+            # which created them
+            key = (sqlalchemy.__version__,
+                   sha1(str(bind.engine.url)).hexdigest(), schema,
+                   tuple(names))
+
+            conn = bind.contextual_connect()
+            try:
+                fingerprint = self.compute_fingerprint(conn, schema)
+            finally:
+                conn.close()
+
+            cached_metadata = None
+            entry = data.get(key)
+            if entry is not None and entry['fingerprint'] == fingerprint:
+                try:
+                    cached_metadata = pickle.loads(entry['metadata'])
+                except Exception:
+                    # a corrupt entry, or tables which cannot be unpickled
+                    # by this version of SQLAlchemy, are simply a miss
+                    pass
+
+            if cached_metadata is not None:
+                self.hits.extend(names)
+            else:
+                cached_metadata = MetaData()
+                group_timings = reflect_tables(cached_metadata, names, schema,
+                                               bind=bind, threads=threads)
+                for name, duration in group_timings.iteritems():
+                    if schema is not None:
+                        name = '%s.%s' % (schema, name)
+                    timings[name] = duration
+                # entries for other versions of SQLAlchemy or other sets of
+                # entities, storing some of the same tables, are superseded
+                for other_key in data.keys():
+                    if other_key[1:3] == key[1:3] and \
+                       set(other_key[3]) & set(names):
+                        del data[other_key]
+                data[key] = {
+                    'fingerprint': fingerprint,
+                    'metadata': pickle.dumps(cached_metadata,
+                                             pickle.HIGHEST_PROTOCOL)
+                }
+                changed = True
+                self.misses.extend(names)
+
+            for table_key, table in cached_metadata.tables.items():
+                if table_key not in metadata.tables:
+                    table.tometadata(metadata)
+
+        if changed:
+            self.save(data)
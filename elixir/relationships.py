@@ -404,7 +404,6 @@ import warnings
 
 from sqlalchemy import ForeignKeyConstraint, Column, Table, and_
 from sqlalchemy.orm import relation, backref, class_mapper
-from sqlalchemy.ext.associationproxy import association_proxy
 
 import options
 from elixir.statements import ClassMutator
@@ -434,6 +433,15 @@ class Relationship(Property):
         self.args = args
         self.kwargs = kwargs
 
+    def clone(self):
+        clone = super(Relationship, self).clone()
+        clone.property = None
+        clone.backref = None
+        if not isinstance(self.of_kind, EntityMeta):
+            clone._target = None
+        clone.__dict__.pop('_inverse', None)
+        return clone
+
     def attach(self, entity, name):
         super(Relationship, self).attach(entity, name)
         entity._descriptor.relationships.append(self)
@@ -475,6 +483,11 @@ class Relationship(Property):
                 # let the user override the backref argument
                 if 'backref' not in kwargs:
                     kwargs['backref'] = self.inverse.backref
+            elif self.inverse.property is not None:
+                # the inverse was set up before this relationship was added
+                # to its entity (by an incremental setup), so it cannot use a
+                # backref anymore: both are standalone relations.
+                pass
             else:
                 # SQLAlchemy doesn't like when 'secondary' is both defined on
                 # the relation and the backref
@@ -1230,6 +1243,7 @@ def rel_mutator_handler(target):
     def handler(entity, name, of_kind=None, through=None, via=None,
                 *args, **kwargs):
         if through and via:
+            from sqlalchemy.ext.associationproxy import association_proxy
             setattr(entity, name,
                     association_proxy(through, via, **kwargs))
             return
@@ -0,0 +1,294 @@
+'''
+Dependency-graph scheduling of the setup phase of entities.
+
+By default, `setup_entities` is "phase-major": it runs the first setup phase
+on all entities, then the second phase on all entities, and so on. The
+scheduler in this module builds an explicit dependency graph of the entities
+instead, with an edge from each entity to:
+
+- its parent and children entities (inheritance);
+- the targets of its relationships;
+- the entities sharing a many-to-many table with it.
+
+Entities which depend on each other (for example the two sides of a
+bidirectional relationship, or the entities of an inheritance hierarchy) form
+a strongly connected component of that graph, and are set up together, phase
+after phase. The components themselves are set up one after the other, in
+topological order (the components an entity depends on being set up first).
+
+This means an error in one part of the model surfaces as soon as the
+corresponding component is set up, and that a subset of the model can be set
+up on its own (along with the entities it depends on):
+
+.. sourcecode:: python
+
+    from elixir.scheduler import SetupScheduler
+
+    scheduler = SetupScheduler(entities)
+    scheduler.run([Invoice])        # set up Invoice and its dependencies
+    scheduler.run()                 # set up everything else
+
+    print scheduler.report()
+
+The tables of the autoloaded entities of the scheduled components can be
+reflected concurrently before the components are set up, by giving a number
+of threads to `run` (see the `elixir.reflection` module).
+
+The scheduler also records the time spent setting up each component, and can
+compute the critical path of the graph: the chain of dependent components
+which took the longest to set up, and thus bounds the time the setup would
+take if independent components were set up in parallel.
+
+The scheduler is used by `setup_all` when given the `schedule` keyword
+argument. The last scheduler used that way is available as the
+`last_scheduler` attribute of this module.
+'''
+
+import time
+
+from elixir.entity import EntityMeta, RelationshipIndex, setup_phases, \
+                          remove_property_attrs
+from elixir.reflection import reflect_autoloaded_tables
+
+__doc_all__ = []
+
+# the scheduler used by the last call to setup_all(schedule=...)
+last_scheduler = None
+
+
+def entity_dependencies(entity):
+    '''
+    Return the entities `entity` is directly linked to, through inheritance
+    or its relationships.
+    '''
+    desc = entity._descriptor
+    dependencies = []
+    if desc.parent:
+        dependencies.append(desc.parent)
+    dependencies.extend(desc.children)
+    for rel in desc.relationships:
+        if isinstance(rel.target, EntityMeta):
+            dependencies.append(rel.target)
+    return dependencies
+
+
+def strongly_connected_components(nodes, edges):
+    '''
+    Return the strongly connected components of the graph made of `nodes`
+    and `edges` (a dictionary of the successors of each node), using
+    Tarjan's algorithm. A component is only returned after all the components
+    reachable from it, so when edges go from an entity to its dependencies,
+    dependencies come first.
+    '''
+    # this is an iterative version of the algorithm, so that very large
+    # models do not hit the recursion limit.
+    indexes = {}
+    lowlinks = {}
+    stack = []
+    on_stack = set()
+    components = []
+    counter = 0
+
+    for root in nodes:
+        if root in indexes:
+            continue
+        work = [(root, iter(edges.get(root, ())))]
+        indexes[root] = lowlinks[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            node, successors = work[-1]
+            for successor in successors:
+                if successor not in indexes:
+                    indexes[successor] = lowlinks[successor] = counter
+                    counter += 1
+                    stack.append(successor)
+                    on_stack.add(successor)
+                    work.append((successor,
+                                 iter(edges.get(successor, ()))))
+                    break
+                elif successor in on_stack:
+                    lowlinks[node] = min(lowlinks[node], indexes[successor])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlinks[parent] = min(lowlinks[parent], lowlinks[node])
+                if lowlinks[node] == indexes[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member is node:
+                            break
+                    components.append(component)
+    return components
+
+
+class SetupScheduler(object):
+    '''
+    Set up a list of entities one dependency component at a time.
+    '''
+
+    def __init__(self, entities):
+        self.entities = [entity for entity in entities
+                         if not hasattr(entity, '_setup_done')]
+        positions = dict((entity, position)
+                         for position, entity in enumerate(self.entities))
+
+        edges = {}
+        for entity in self.entities:
+            edges[entity] = [dependency
+                             for dependency in entity_dependencies(entity)
+                             if dependency in positions]
+
+        # entities sharing a many-to-many table need to be set up together,
+        # as only one of them creates the table.
+        m2m_tables = {}
+        for entity in self.entities:
+            desc = entity._descriptor
+            for rel in desc.relationships:
+                tablename = getattr(rel, 'user_tablename', None)
+                if tablename:
+                    key = (desc.metadata, rel.schema, tablename)
+                    m2m_tables.setdefault(key, []).append(entity)
+        for sharing in m2m_tables.itervalues():
+            for entity in sharing:
+                edges[entity].extend([other for other in sharing
+                                      if other is not entity])
+
+        # the entities of each component are kept in their original order,
+        # so that parents are set up before their children
+        self.components = [
+            sorted(component, key=positions.__getitem__)
+            for component in strongly_connected_components(self.entities,
+                                                           edges)]
+        self.component_of = {}
+        for num, component in enumerate(self.components):
+            for entity in component:
+                self.component_of[entity] = num
+
+        # the components each component directly depends on
+        self.dependencies = []
+        for num, component in enumerate(self.components):
+            dependencies = set()
+            for entity in component:
+                for dependency in edges[entity]:
+                    dependencies.add(self.component_of[dependency])
+            dependencies.discard(num)
+            self.dependencies.append(sorted(dependencies))
+
+        # time spent setting up each component
+        self.durations = {}
+
+    def closure(self, targets):
+        '''
+        Return the (sorted) numbers of the components needed to set up the
+        entities in `targets`.
+        '''
+        closure = set()
+        to_visit = [self.component_of[entity] for entity in targets
+                    if entity in self.component_of]
+        while to_visit:
+            num = to_visit.pop()
+            if num in closure:
+                continue
+            closure.add(num)
+            to_visit.extend(self.dependencies[num])
+        return sorted(closure)
+
+    def run(self, targets=None, threads=None):
+        '''
+        Set up the entities in `targets` along with all the entities they
+        depend on, or all the entities of the scheduler if `targets` is None.
+        Components which were already set up by a previous call are skipped.
+
+        If `threads` is given, the tables of the autoloaded entities of the
+        scheduled components are first reflected concurrently, using that
+        number of threads.
+        '''
+        if targets is None:
+            nums = range(len(self.components))
+        else:
+            nums = self.closure(targets)
+        nums = [num for num in nums if num not in self.durations]
+
+        entities = []
+        for num in nums:
+            entities.extend(self.components[num])
+        for entity in entities:
+            remove_property_attrs(entity)
+
+        if threads:
+            reflect_autoloaded_tables(entities, threads=threads)
+
+        index = RelationshipIndex(entities)
+        for entity in entities:
+            entity._descriptor.relationship_index = index
+        try:
+            for num in nums:
+                start = time.time()
+                setup_phases(self.components[num])
+                self.durations[num] = time.time() - start
+        finally:
+            for entity in entities:
+                entity._descriptor.relationship_index = None
+
+    def critical_path(self):
+        '''
+        Return the chain of dependent components which took the longest to
+        set up, as a (total time, list of components) tuple. Only the
+        components which were set up by this scheduler are considered.
+        '''
+        finish = {}
+        previous = {}
+        # components come after the components they depend on
+        for num in range(len(self.components)):
+            if num not in self.durations:
+                continue
+            start = 0.0
+            previous[num] = None
+            for dependency in self.dependencies[num]:
+                if finish.get(dependency, 0.0) > start:
+                    start = finish[dependency]
+                    previous[num] = dependency
+            finish[num] = start + self.durations[num]
+        if not finish:
+            return 0.0, []
+
+        last = None
+        for num in finish:
+            if last is None or finish[num] > finish[last]:
+                last = num
+        path = []
+        num = last
+        while num is not None:
+            path.append(self.components[num])
+            num = previous[num]
+        path.reverse()
+        return finish[last], path
+
+    def report(self):
+        '''
+        Return a text report of the components, in the order they are set
+        up, and of the critical path.
+        '''
+        lines = ['%d entities, %d components'
+                 % (len(self.entities), len(self.components))]
+        for num, component in enumerate(self.components):
+            duration = self.durations.get(num)
+            if duration is None:
+                duration = '-'
+            else:
+                duration = '%.4f' % duration
+            lines.append('%4d %10s  %s'
+                         % (num, duration,
+                            ', '.join([e.__name__ for e in component])))
+        total, path = self.critical_path()
+        lines.append('critical path (%.4f): %s'
+                     % (total, ' -> '.join(['[%s]' % ', '.join(
+                                                [e.__name__ for e in c])
+                                            for c in path])))
+        return '\n'.join(lines)
@@ -0,0 +1,62 @@
+'''
+Compare the time needed to declare entities inheriting their fields from an
+abstract base class, when the inherited properties are cloned (Property.clone)
+and when they are deep-copied instead.
+
+Usage: python abstract_clone.py [number of entities] [number of columns]
+'''
+
+import copy
+import sys
+import time
+
+from elixir import *
+
+
+def declare_model(count, columns):
+    fields = dict([('field%d' % num, Field(Unicode(30), default=u'',
+                                           index=True))
+                   for num in range(columns)])
+
+    class Base(Entity):
+        using_options(abstract=True)
+        # the namespace of a class body is a plain dictionary
+        locals().update(fields)
+
+    for num in range(count):
+        type('Concrete%d' % num, (Base,), {'__module__': __name__})
+
+
+def deepcopy_clone(self):
+    clone = copy.deepcopy(self)
+    clone.entity = None
+    clone.name = None
+    return clone
+
+
+def run(count, columns, clone):
+    original = Field.clone
+    Field.clone = clone
+    try:
+        start = time.time()
+        declare_model(count, columns)
+        duration = time.time() - start
+    finally:
+        Field.clone = original
+        cleanup_all()
+    return duration
+
+
+if __name__ == '__main__':
+    count = 500
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    columns = 20
+    if len(sys.argv) > 2:
+        columns = int(sys.argv[2])
+
+    for name, clone in (('clone', Field.clone.im_func),
+                        ('deepcopy', deepcopy_clone)):
+        duration = run(count, columns, clone)
+        print '%-10s %8.3fs %10.0f entities/s' % (name, duration,
+                                                  count / duration)
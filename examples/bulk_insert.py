@@ -0,0 +1,62 @@
+'''
+Compare the time needed to insert rows through the session and through
+Entity.bulk_insert.
+
+Usage: python bulk_insert.py [number of rows] [database url]
+'''
+
+import sys
+import time
+
+from elixir import *
+
+
+class Movie(Entity):
+    title = Field(Unicode(60))
+    year = Field(Integer)
+    rating = Field(Integer, default=0)
+
+
+def rows(count):
+    return [{'title': u'Movie %d' % num, 'year': 1900 + num % 100}
+            for num in range(count)]
+
+
+def session_insert(count):
+    for row in rows(count):
+        Movie(**row)
+    session.commit()
+
+
+def bulk_insert(count):
+    Movie.bulk_insert(rows(count))
+    session.commit()
+
+
+def run(func, count):
+    drop_all()
+    create_all()
+    start = time.time()
+    func(count)
+    duration = time.time() - start
+    assert Movie.query.count() == count
+    session.expunge_all()
+    return duration
+
+
+if __name__ == '__main__':
+    count = 20000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    url = 'sqlite://'
+    if len(sys.argv) > 2:
+        url = sys.argv[2]
+
+    metadata.bind = url
+    setup_all()
+
+    for name, func in (('session', session_insert),
+                       ('bulk_insert', bulk_insert)):
+        duration = run(func, count)
+        print '%-12s %8.3fs %10.0f rows/s' % (name, duration,
+                                              count / duration)
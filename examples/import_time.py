@@ -0,0 +1,52 @@
+'''
+Measure the time needed to import elixir in a fresh interpreter, and compare
+it with the time needed to import all its public names (which are only
+imported when they are first accessed), and to import the optional modules
+(which are only imported when the features using them are used) along with
+them.
+
+Usage: python import_time.py [number of runs]
+'''
+
+import os
+import sys
+import time
+from subprocess import Popen
+
+OPTIONAL_MODULES = ['sqlalchemy.ext.associationproxy', 'elixir.reflection',
+                    'elixir.scheduler', 'elixir.cache']
+
+
+def import_time(statement, runs):
+    '''
+    Return the smallest time needed to run `statement` in a fresh
+    interpreter, minus the time needed to start that interpreter.
+    '''
+    env = os.environ.copy()
+    path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join([path, env.get('PYTHONPATH', '')])
+
+    def best(code):
+        durations = []
+        for num in range(runs):
+            start = time.time()
+            process = Popen([sys.executable, '-c', code], env=env)
+            process.wait()
+            assert process.returncode == 0
+            durations.append(time.time() - start)
+        return min(durations)
+
+    return best(statement) - best('pass')
+
+
+if __name__ == '__main__':
+    runs = 10
+    if len(sys.argv) > 1:
+        runs = int(sys.argv[1])
+
+    for name, statement in (
+            ('import elixir', 'import elixir'),
+            ('from elixir import *', 'from elixir import *'),
+            ('with optional modules',
+             'from elixir import *; import %s' % ', '.join(OPTIONAL_MODULES))):
+        print '%-22s %8.3fs' % (name, import_time(statement, runs))
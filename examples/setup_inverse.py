@@ -0,0 +1,73 @@
+'''
+Compare the time needed to set up a model where one entity is the target of
+many relationships, when inverse relationships are looked up in the index of
+the relationships being set up and when all the relationships of the target
+are scanned instead.
+
+Each model is made of a "Hub" entity and of the given number of entities
+with a ManyToOne relationship to it, whose inverse OneToMany relationships
+are defined on the hub.
+
+Usage: python setup_inverse.py [number of entities ...]
+'''
+
+import sys
+import time
+
+from elixir import *
+from elixir import entity
+
+
+class ScanIndex(object):
+    '''
+    Stand-in for RelationshipIndex returning all the relationships of the
+    target, as the lookup did before relationships were indexed.
+    '''
+
+    def __init__(self, entities):
+        pass
+
+    def get_relationships(self, entity, target):
+        return entity._descriptor.relationships
+
+
+def declare_model(count):
+    hub_dict = {'__module__': __name__, 'name': Field(Unicode(30))}
+    for num in range(count):
+        hub_dict['items%d' % num] = OneToMany('Item%d' % num)
+    type('Hub', (Entity,), hub_dict)
+
+    for num in range(count):
+        type('Item%d' % num, (Entity,), {
+            '__module__': __name__,
+            'name': Field(Unicode(30)),
+            'hub': ManyToOne('Hub'),
+        })
+
+
+def run(count, index_class):
+    original = entity.RelationshipIndex
+    entity.RelationshipIndex = index_class
+    try:
+        declare_model(count)
+        start = time.time()
+        setup_all()
+        duration = time.time() - start
+    finally:
+        entity.RelationshipIndex = original
+        cleanup_all()
+    return duration
+
+
+if __name__ == '__main__':
+    sizes = [100, 1000, 5000]
+    if len(sys.argv) > 1:
+        sizes = [int(arg) for arg in sys.argv[1:]]
+
+    metadata.bind = 'sqlite://'
+
+    print '%8s %10s %10s' % ('entities', 'index', 'scan')
+    for count in sizes:
+        print '%8d %9.3fs %9.3fs' % (count,
+                                     run(count, entity.RelationshipIndex),
+                                     run(count, ScanIndex))
@@ -4,6 +4,9 @@ test inheritance with abstract entities
 
 import re
 
+from sqlalchemy import ForeignKey
+from sqlalchemy.orm import synonym
+
 from elixir import *
 import elixir
 
@@ -195,3 +198,76 @@ class TestAbstractInheritance(object):
                                      last_name=u"van Rossum")
         session.commit()
 
+
+    def test_cloned_properties(self):
+        def get_default():
+            return u'default'
+
+        class AbstractOwned(Entity):
+            using_options(abstract=True)
+
+            title = Field(Unicode(50), default=get_default)
+            owner_id = Field(Integer, ForeignKey('owner.id'))
+            tags = ManyToMany('Tag')
+
+        class Owner(Entity):
+            using_options(tablename='owner')
+
+        class Tag(Entity):
+            name = Field(Unicode(20))
+
+        class Document(AbstractOwned):
+            pass
+
+        class Picture(AbstractOwned):
+            pass
+
+        setup_all(True)
+
+        # foreign keys are not shared between the inheriting entities
+        doc_fk = list(Document.table.c.owner_id.foreign_keys)[0]
+        pic_fk = list(Picture.table.c.owner_id.foreign_keys)[0]
+        assert doc_fk is not pic_fk
+        assert doc_fk.column is Owner.table.c.id
+
+        # the declaration order of the base class is kept
+        assert Document.table.columns.keys()[1:] == ['title', 'owner_id']
+
+        Document(tags=[Tag(name=u'a')])
+        Picture(tags=[Tag(name=u'b')])
+        session.commit()
+        session.expunge_all()
+
+        assert Document.query.one().title == u'default'
+        assert Picture.query.one().tags[0].name == u'b'
+
+    def test_cloned_generic_property(self):
+        class AbstractNamed(Entity):
+            using_options(abstract=True)
+
+            name = Field(String(30))
+            alias = GenericProperty(synonym('name'))
+
+        class D1(AbstractNamed):
+            pass
+
+        class D2(AbstractNamed):
+            pass
+
+        setup_all(True)
+
+        # the SQLAlchemy property is not shared between the inheriting
+        # entities
+        prop1 = D1.mapper.get_property('alias')
+        prop2 = D2.mapper.get_property('alias')
+        assert prop1 is not prop2
+        assert prop1.parent is D1.mapper
+        assert prop2.parent is D2.mapper
+
+        D1(alias='a')
+        D2(name='b')
+        session.commit()
+        session.expunge_all()
+
+        assert D1.query.one().name == 'a'
+        assert D2.query.one().alias == 'b'
@@ -2,10 +2,29 @@
 test autoloaded entities
 """
 
-from sqlalchemy import Table, Column, ForeignKey
+import os
+import pickle
+import shutil
+import tempfile
+
+from sqlalchemy import MetaData, Table, Column, ForeignKey
 from elixir import *
+from elixir.reflection import ReflectionCache
 import elixir
 
+def tables_unpickle():
+    '''
+    Return whether this version of SQLAlchemy can unpickle a MetaData
+    containing tables.
+    '''
+    meta = MetaData()
+    Table('t', meta, Column('id', Integer, primary_key=True))
+    try:
+        pickle.loads(pickle.dumps(meta, pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return False
+    return True
+
 def setup_entity_raise(cls):
     try:
         setup_entities([cls])
@@ -260,6 +279,142 @@ class TestAutoload(object):
 #        assert len(c.persons) == 4
 #        assert c in grampa.categories
 
+    def test_bulk_reflect(self):
+        person_table = Table('person', metadata,
+            Column('id', Integer, primary_key=True),
+            Column('name', String(32)))
+
+        category_table = Table('category', metadata,
+            Column('name', String(30), primary_key=True))
+
+        person_category_table = Table('person_category', metadata,
+            Column('person_id', Integer, ForeignKey('person.id')),
+            Column('category_name', String(30), ForeignKey('category.name')))
+
+        metadata.create_all()
+        metadata.clear()
+
+        class Person(Entity):
+            categories = ManyToMany('Category',
+                                    tablename='person_category')
+
+        class Category(Entity):
+            persons = ManyToMany('Person',
+                                 tablename='person_category')
+
+        setup_all(reflect=True)
+
+        from elixir import reflection
+        assert sorted(reflection.timings.keys()) == \
+               ['category', 'person', 'person_category']
+
+        homer = Person(name="Homer", categories=[Category(name="Stupid")])
+
+        session.commit()
+        session.expunge_all()
+
+        assert Category.get_by(name="Stupid").persons[0].name == "Homer"
+
+    def test_reflection_cache(self):
+        conn = metadata.bind.connect()
+        conn.execute("CREATE TABLE a ("
+                     "id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                     "name VARCHAR(32))")
+        conn.close()
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            cache = ReflectionCache(os.path.join(tmpdir, 'reflection.cache'))
+
+            class A(Entity):
+                pass
+
+            setup_all(reflection_cache=cache)
+            assert cache.misses == ['a']
+
+            cleanup_all()
+
+            class A(Entity):
+                pass
+
+            setup_all(reflection_cache=cache)
+            if tables_unpickle():
+                assert cache.hits == ['a']
+            else:
+                assert cache.misses == ['a']
+
+            A(name="a1")
+            session.commit()
+            session.expunge_all()
+
+            assert A.get_by(name="a1").name == 'a1'
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_reflection_cache_eviction(self):
+        conn = metadata.bind.connect()
+        conn.execute("CREATE TABLE a ("
+                     "id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                     "name VARCHAR(32))")
+        conn.execute("CREATE TABLE b ("
+                     "id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                     "name VARCHAR(32))")
+        conn.close()
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            cache = ReflectionCache(os.path.join(tmpdir, 'reflection.cache'))
+
+            class A(Entity):
+                pass
+
+            setup_all(reflection_cache=cache)
+            cleanup_all()
+
+            # the entry for the new set of entities replaces the previous one
+            class A(Entity):
+                pass
+
+            class B(Entity):
+                pass
+
+            setup_all(reflection_cache=cache)
+            assert cache.misses == ['a', 'b']
+            assert len(cache.load()) == 1
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_reflection_cache_corrupt_entry(self):
+        conn = metadata.bind.connect()
+        conn.execute("CREATE TABLE a ("
+                     "id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                     "name VARCHAR(32))")
+        conn.close()
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            cache = ReflectionCache(os.path.join(tmpdir, 'reflection.cache'))
+
+            class A(Entity):
+                pass
+
+            setup_all(reflection_cache=cache)
+            cleanup_all()
+
+            data = cache.load()
+            for entry in data.itervalues():
+                entry['metadata'] = 'not a pickle'
+            cache.save(data)
+
+            class A(Entity):
+                pass
+
+            setup_all(reflection_cache=cache)
+            assert cache.misses == ['a']
+            assert 'name' in A.table.columns
+        finally:
+            shutil.rmtree(tmpdir)
+
     def test_m2m_selfref(self):
         person_table = Table('person', metadata,
             Column('id', Integer, primary_key=True),
@@ -0,0 +1,107 @@
+"""
+test inserting rows without going through the session
+"""
+
+from elixir import *
+from elixir.events import before_insert
+from elixir.ext.versioned import acts_as_versioned
+
+
+def setup():
+    metadata.bind = 'sqlite://'
+
+
+class TestBulkInsert(object):
+    def teardown(self):
+        cleanup_all(True)
+
+    def test_simple(self):
+        class A(Entity):
+            name = Field(String(30))
+            value = Field(Integer, default=3)
+
+        setup_all(True)
+
+        rows = [{'name': 'a%d' % num} for num in range(5)]
+        assert A.bulk_insert(rows, batch_size=2) == 5
+        assert 'id' not in rows[0]
+
+        assert A.query.count() == 5
+        assert A.get_by(name='a4').value == 3
+
+    def test_return_defaults(self):
+        class A(Entity):
+            name = Field(String(30))
+
+        setup_all(True)
+
+        rows = [{'name': 'a1'}, {'name': 'a2'}]
+        A.bulk_insert(rows, return_defaults=True)
+        assert A.get(rows[1]['id']).name == 'a2'
+
+    def test_multi_inheritance(self):
+        class Person(Entity):
+            name = Field(String(30))
+            using_options(inheritance='multi')
+
+        class Employee(Person):
+            salary = Field(Integer)
+            using_options(inheritance='multi')
+
+        setup_all(True)
+
+        Employee.bulk_insert([{'name': 'e1', 'salary': 10},
+                              {'name': 'e2', 'salary': 20}])
+        session.expunge_all()
+
+        people = Person.query.order_by('name').all()
+        assert [p.__class__ for p in people] == [Employee, Employee]
+        assert people[1].salary == 20
+
+    def test_multi_inheritance_other_foreign_key(self):
+        class Person(Entity):
+            name = Field(String(30))
+            using_options(inheritance='multi')
+
+        class Employee(Person):
+            manager = ManyToOne('Person')
+            using_options(inheritance='multi')
+
+        setup_all(True)
+
+        Person.bulk_insert([{'name': 'p1'}])
+        Employee.bulk_insert([{'name': 'e1'}])
+        session.expunge_all()
+
+        # only the columns joining the child table to its parent take the
+        # values of the parent columns
+        assert Employee.get_by(name='e1').manager is None
+
+    def test_versioned(self):
+        class A(Entity):
+            name = Field(String(30))
+            acts_as_versioned()
+
+        setup_all(True)
+
+        A.bulk_insert([{'name': 'a1'}])
+        a = A.get_by(name='a1')
+        assert a.version == 1
+        assert a.timestamp is not None
+
+    def test_insert_event(self):
+        class A(Entity):
+            name = Field(String(30))
+
+            @before_insert
+            def check(self):
+                pass
+
+        setup_all(True)
+
+        try:
+            A.bulk_insert([{'name': 'a1'}])
+        except Exception:
+            pass
+        else:
+            assert False, "insert events were silently skipped"
@@ -0,0 +1,171 @@
+"""
+test the get_by result cache
+"""
+
+import gc
+import os
+import shutil
+import tempfile
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import create_session
+
+from elixir import *
+from elixir.cache import QueryCache, instance_values
+
+
+def setup():
+    metadata.bind = 'sqlite://'
+
+
+class TestQueryCache(object):
+    def teardown(self):
+        cleanup_all(True)
+
+    def test_lru(self):
+        cache = QueryCache(size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        assert cache.get('a') == (True, 1)
+        cache.set('c', 3)
+        assert cache.get('b') == (False, None)
+        assert cache.get('a') == (True, 1)
+        assert cache.get('c') == (True, 3)
+        assert cache.stats()['evictions'] == 1
+
+    def test_ttl(self):
+        cache = QueryCache(ttl=-1)
+        cache.set('a', 1)
+        assert cache.get('a') == (False, None)
+
+    def test_get_by(self):
+        class A(Entity):
+            name = Field(String(30))
+            using_options(query_cache=10)
+
+        setup_all(True)
+
+        A(name='a1')
+        session.commit()
+        session.expunge_all()
+
+        cache = A._descriptor.query_cache
+        a1 = A.get_by(name='a1')
+        assert A.get_by(name='a1') is a1
+        assert cache.stats()['hits'] == 1
+        assert cache.stats()['misses'] == 1
+
+        # negative results are invalidated by inserts
+        assert A.get_by(name='a2') is None
+        A(name='a2')
+        session.commit()
+        assert A.get_by(name='a2').name == 'a2'
+
+        # updates invalidate the entries of the instance
+        a1.name = 'b1'
+        session.commit()
+        assert A.get_by(name='a1') is None
+        assert cache.stats()['invalidations'] >= 2
+
+    def test_get_by_bulk_insert(self):
+        class A(Entity):
+            name = Field(String(30))
+            using_options(query_cache=True)
+
+        setup_all(True)
+
+        assert A.get_by(name='a1') is None
+        assert A.bulk_insert([{'name': 'a1'}, {'name': 'a2'}]) == 2
+        assert A.get_by(name='a1').name == 'a1'
+
+    def test_get(self):
+        class Country(Entity):
+            code = Field(String(2))
+            using_options(pk_cache=True)
+
+        setup_all(True)
+
+        Country(code='be')
+        session.commit()
+        session.close()
+
+        cache = Country._descriptor.pk_cache
+        be = Country.get(1)
+        assert be.code == 'be'
+        session.close()
+
+        # an instance is rebuilt from the cache in the new session
+        Country.table.update().execute(code='xx')
+        be = Country.get(1)
+        assert be.code == 'be'
+        assert be in session
+        assert cache.stats()['hits'] == 1
+
+        # flushing changes invalidates the cache
+        be.code = 'fr'
+        session.commit()
+        session.close()
+        assert Country.get(1).code == 'fr'
+        assert cache.stats()['invalidations'] == 1
+
+    def test_get_rolled_back(self):
+        class Country(Entity):
+            code = Field(String(2))
+            using_options(pk_cache=True)
+
+        setup_all(True)
+
+        Country(code='be')
+        session.commit()
+        session.close()
+
+        be = Country.get(1)
+        be.code = 'fr'
+        session.flush()
+        # let the (weak) identity map drop the instance, so that it is read
+        # again from the database, with the values flushed in the transaction
+        del be
+        gc.collect()
+        assert Country.get(1).code == 'fr'
+
+        session.rollback()
+        session.close()
+        assert Country.get(1).code == 'be'
+
+    def test_get_invalidated_on_commit(self):
+        class Country(Entity):
+            code = Field(String(2))
+            using_options(pk_cache=True)
+
+        # the sessions need their own connections, to the same database
+        tmpdir = tempfile.mkdtemp()
+        url = 'sqlite:///%s' % os.path.join(tmpdir, 'test.db')
+        metadata.bind = url
+        try:
+            setup_all(True)
+
+            Country(code='be')
+            session.commit()
+            session.close()
+
+            be = Country.get(1)
+            be.code = 'fr'
+            session.flush()
+
+            # between the flush and the commit, another session still reads
+            # (and caches) the committed values
+            other = create_session(bind=create_engine(url))
+            old = other.query(Country).get(1)
+            assert old.code == 'be'
+            cache = Country._descriptor.pk_cache
+            cache.set((1,), instance_values(old))
+            other.close()
+
+            session.commit()
+            session.close()
+            assert Country.get(1).code == 'fr'
+        finally:
+            cleanup_all(True)
+            metadata.bind.dispose()
+            metadata.bind = 'sqlite://'
+            shutil.rmtree(tmpdir)
@@ -26,3 +26,74 @@ class TestOldMethods(object):
 
         assert A.get(1).name == "a1"
 
+
+    def test_get_many(self):
+        class A(Entity):
+            name = Field(String(32))
+
+        class B(A):
+            value = Field(Integer)
+
+        setup_all(True)
+
+        A(name="a1")
+        B(name="b2", value=2)
+        A(name="a3")
+
+        session.commit()
+        session.expunge_all()
+
+        a3 = A.get(3)
+        result = A.get_many([3, 5, 2, 1, 3], chunk_size=2)
+        assert result[0] is a3
+        assert result[1] is None
+        assert isinstance(result[2], B)
+        assert result[3].name == "a1"
+        assert result[4] is a3
+
+    def test_get_many_composite(self):
+        class A(Entity):
+            key1 = Field(Integer, primary_key=True)
+            key2 = Field(String(32), primary_key=True)
+
+        setup_all(True)
+
+        A(key1=1, key2='a')
+        A(key1=1, key2='b')
+
+        session.commit()
+        session.expunge_all()
+
+        result = A.get_many([(1, 'b'), (2, 'a'), (1, 'a')])
+        assert [a and a.key2 for a in result] == ['b', None, 'a']
+
+    def test_snapshots(self):
+        class A(Entity):
+            name = Field(String(32))
+            b = ManyToOne('B')
+
+        class B(Entity):
+            name = Field(String(32))
+
+        setup_all(True)
+
+        A(name="a1", b=B(name="b1"))
+        A(name="a2")
+
+        session.commit()
+        session.expunge_all()
+
+        snapshots = A.snapshots(A.query.order_by(A.name))
+        assert len(session.identity_map) == 0
+        assert [s.name for s in snapshots] == ["a1", "a2"]
+        assert snapshots[0].b_id == 1
+        assert snapshots[1].b_id is None
+        assert not hasattr(snapshots[0], 'b')
+        assert not hasattr(snapshots[0], '__dict__')
+
+        try:
+            snapshots[0].name = "changed"
+        except AttributeError:
+            pass
+        else:
+            assert False, "snapshots should be read-only"
@@ -2,6 +2,8 @@
 Test collections
 """
 
+import sys
+
 from sqlalchemy import Table
 from elixir import *
 import elixir
@@ -64,6 +66,46 @@ class TestCollections(object):
 
         assert collection.A == A
 
+    def test_resolve(self):
+        collection = EntityCollection()
+
+        class A(Entity):
+            name = Field(String(30))
+            using_options(collection=collection)
+
+        class B(Entity):
+            name = Field(String(30))
+            using_options(collection=collection)
+
+        fullname = '%s.A' % A.__module__
+        assert collection.resolve(fullname) is A
+        assert collection.resolve_many(['A', 'B']) == [A, B]
+
+        collection.clear()
+        assert fullname not in collection._fullnames
+
+    def test_resolve_stale_cache(self):
+        collection = EntityCollection()
+
+        module = sys.modules[__name__]
+        module.StaleA = None
+        try:
+            class StaleA(Entity):
+                name = Field(String(30))
+            module.StaleA = StaleA
+
+            fullname = '%s.StaleA' % __name__
+            assert collection.resolve(fullname) is StaleA
+
+            # the class is redefined (as when its module is reloaded)
+            class StaleA(Entity):
+                name = Field(String(30))
+            module.StaleA = StaleA
+
+            assert collection.resolve(fullname) is StaleA
+        finally:
+            del module.StaleA
+
     def test_setup_after_cleanup(self):
         class A(Entity):
             name = Field(String(30))
@@ -2,10 +2,24 @@
     test the deep-set functionality
 """
 
+from sqlalchemy import create_engine
+from sqlalchemy.interfaces import ConnectionProxy
 from elixir import *
 
+class SelectCounter(ConnectionProxy):
+    '''Count the SELECT statements executed on the engine.'''
+    count = 0
+
+    def cursor_execute(self, execute, cursor, statement, parameters,
+                       context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            self.count += 1
+        return execute(cursor, statement, parameters, context)
+
+selects = SelectCounter()
+
 def setup():
-    metadata.bind = 'sqlite://'
+    metadata.bind = create_engine('sqlite://', proxy=selects)
 
     global Table1, Table2, Table3
     class Table1(Entity):
@@ -87,6 +101,23 @@ class TestDeepSet(object):
         assert len(t1.tbl2s) == 1
         assert t1.tbl2s[0].name == 'test4'
 
+    def test_update_list_items_batched(self):
+        t1 = Table1()
+        t1.tbl2s = [Table2(name='a%d' % num) for num in range(3)]
+        session.commit()
+        ids = [t2.t2id for t2 in t1.tbl2s]
+        session.expunge_all()
+
+        t1 = Table1.get(t1.t1id)
+        selects.count = 0
+        t1.from_dict(dict(tbl2s=[{'t2id': t2id, 'name': 'b'} for t2id in ids]
+                                + [{'name': 'new'}]))
+        # one query for the rows of Table2, and one to load the collection
+        # being replaced
+        assert selects.count == 2
+        assert [t2.name for t2 in t1.tbl2s] == ['b', 'b', 'b', 'new']
+        assert [t2.t2id for t2 in t1.tbl2s[:3]] == ids
+
     def test_invalid_update(self):
         t1 = Table1()
         t2 = Table2()
@@ -154,6 +185,117 @@ class TestDeepSet(object):
                          'tbl3': {'t3id': 1,
                                   'name': 'test3'}}}
 
+    def test_to_dicts(self):
+        t1 = Table1(t1id=54, name='test1')
+        t1.tbl2s = [Table2(t2id=51, name='a'), Table2(t2id=52, name='b')]
+        t1.tbl3 = Table3(t3id=51, name='c')
+        session.commit()
+
+        expected = [{'t2id': 51, 'name': 'a',
+                     'tbl1': {'name': 'test1', 'tbl3': {'t3id': 51,
+                                                        'name': 'c'}}},
+                    {'t2id': 52, 'name': 'b',
+                     'tbl1': {'name': 'test1', 'tbl3': {'t3id': 51,
+                                                        'name': 'c'}}}]
+        query = Table2.query.filter(Table2.t2id.in_([51, 52])) \
+                            .order_by(Table2.t2id)
+        deep = {'tbl1': {'tbl3': {}}}
+        assert Table2.to_dicts(query, deep=deep,
+                               exclude=['tbl1_t1id']) == expected
+        assert [t2.to_dict(deep, ['tbl1_t1id']) for t2 in query] == expected
+
+        # the serializer is reused for the same specification
+        desc = Table2._descriptor
+        assert desc.get_serializer(deep, ['tbl1_t1id']) is \
+               desc.get_serializer({'tbl1': {'tbl3': {}}}, ['tbl1_t1id'])
+
+    def test_eager_options(self):
+        t1 = Table1(t1id=55, name='test1')
+        t1.tbl2s = [Table2(t2id=53, name='a')]
+        t1.tbl3 = Table3(t3id=52, name='b')
+        session.commit()
+        session.expunge_all()
+
+        deep = {'tbl2s': {}, 'tbl3': {}}
+        t1 = Table1.query.options(*Table1.eager_options(deep)).get(55)
+        # the relationships are already loaded
+        assert 'tbl2s' in t1.__dict__
+        assert 'tbl3' in t1.__dict__
+        assert t1.to_dict(deep)['tbl3']['name'] == 'b'
+
+    def test_stream_dicts(self):
+        for num in range(1, 8):
+            Table1(t1id=100 + num, name='s%d' % num,
+                   tbl2s=[Table2(t2id=100 + num, name='c%d' % num)])
+        session.commit()
+        session.expunge_all()
+
+        query = Table1.query.filter(Table1.t1id > 100)
+        data = list(Table1.stream_dicts(query, batch_size=3,
+                                        deep={'tbl2s': {}}))
+        assert [d['t1id'] for d in data] == range(101, 108)
+        assert data[6]['tbl2s'] == [{'t2id': 107, 'name': 'c7'}]
+
+        # the streamed instances do not stay in the session
+        assert len(session.identity_map) == 0
+
+    def test_write_json_lines(self):
+        from StringIO import StringIO
+
+        Table1(t1id=120, name='j1')
+        Table1(t1id=121, name='j2')
+        session.commit()
+
+        out = StringIO()
+        query = Table1.query.filter(Table1.t1id >= 120)
+        assert Table1.write_json_lines(out, query, batch_size=1) == 2
+        lines = out.getvalue().splitlines()
+        assert len(lines) == 2
+        assert '"j2"' in lines[1]
+
+    def test_bulk_upsert(self):
+        Table1(t1id=130, name='old')
+        session.commit()
+
+        rows = [{'t1id': 130, 'name': 'new'},
+                {'t1id': 131, 'name': 'u1',
+                 'tbl2s': [{'t2id': 131, 'name': 'c1'}]},
+                {'t1id': 132, 'name': 'u2'}]
+        selects.count = 0
+        assert Table1.bulk_upsert(rows, batch_size=2) == 3
+        # one query per entity and nesting level, for each batch
+        assert selects.count == 3
+        session.commit()
+        session.expunge_all()
+
+        assert Table1.get(130).name == 'new'
+        assert Table1.get(131).tbl2s[0].name == 'c1'
+        assert Table1.query.filter(Table1.t1id >= 130).count() == 3
+
+    def test_bulk_upsert_nested_without_pk(self):
+        Table1(t1id=140, name='old')
+        session.commit()
+
+        rows = [{'t1id': 140, 'tbl2s': [{'name': 'c1'}],
+                 'tbl3': {'name': 'd1'}},
+                {'t1id': 141, 'tbl2s': [{'name': 'c2'}, {'name': 'c3'}]}]
+        assert Table1.bulk_upsert(rows) == 2
+        session.commit()
+        session.expunge_all()
+
+        assert [t2.name for t2 in Table1.get(140).tbl2s] == ['c1']
+        assert Table1.get(140).tbl3.name == 'd1'
+        assert sorted([t2.name for t2 in Table1.get(141).tbl2s]) == \
+               ['c2', 'c3']
+
+    def test_update_or_create_nested_without_pk(self):
+        t1 = Table1.update_or_create({'t1id': 150, 'tbl2s': [{'name': 'x'}]},
+                                     surrogate=False)
+        session.commit()
+        session.expunge_all()
+
+        assert [t2.name for t2 in Table1.get(150).tbl2s] == ['x']
+
 class TestSetOnAliasedColumn(object):
     def setup(self):
         metadata.bind = 'sqlite://'
@@ -175,3 +317,92 @@ class TestSetOnAliasedColumn(object):
         session.commit()
         session.expunge_all()
 
+class TestNestedUpsert(object):
+    def setup(self):
+        metadata.bind = create_engine('sqlite://', proxy=selects)
+        session.expunge_all()
+
+    def teardown(self):
+        cleanup_all(True)
+
+    def test_bulk_upsert_three_levels(self):
+        class A(Entity):
+            id = Field(Integer, primary_key=True)
+            b = ManyToOne('B')
+
+        class B(Entity):
+            id = Field(Integer, primary_key=True)
+            cs = OneToMany('C')
+
+        class C(Entity):
+            id = Field(Integer, primary_key=True)
+            b = ManyToOne('B')
+
+        setup_all(True)
+
+        # the rows of the second and third levels do not exist yet either
+        assert A.bulk_upsert([{'id': 1, 'b': {'id': 10,
+                                              'cs': [{'id': 100}]}}]) == 1
+        session.commit()
+        session.expunge_all()
+
+        assert A.get(1).b.id == 10
+        assert [c.id for c in B.get(10).cs] == [100]
+
+    def test_stream_dicts_expunge_cascade(self):
+        class A(Entity):
+            id = Field(Integer, primary_key=True)
+            bs = OneToMany('B', cascade='all, delete-orphan')
+
+        class B(Entity):
+            id = Field(Integer, primary_key=True)
+            a = ManyToOne('A')
+
+        setup_all(True)
+
+        for num in range(1, 6):
+            A(id=num, bs=[B(id=num * 10), B(id=num * 10 + 1)])
+        session.commit()
+        session.expunge_all()
+
+        # the children are removed from the session along with their parent
+        data = list(A.stream_dicts(batch_size=2, deep={'bs': {}}))
+        assert [d['id'] for d in data] == range(1, 6)
+        assert [b['id'] for b in data[4]['bs']] == [50, 51]
+        assert len(session.identity_map) == 0
+
+    def test_from_dict_three_levels(self):
+        class A(Entity):
+            id = Field(Integer, primary_key=True)
+            name = Field(String(30))
+            bs = OneToMany('B')
+
+        class B(Entity):
+            id = Field(Integer, primary_key=True)
+            name = Field(String(30))
+            a = ManyToOne('A')
+            cs = OneToMany('C')
+
+        class C(Entity):
+            id = Field(Integer, primary_key=True)
+            name = Field(String(30))
+            b = ManyToOne('B')
+
+        setup_all(True)
+
+        a = A(id=1, bs=[B(id=num, cs=[C(id=num * 10 + sub)
+                                      for sub in range(2)])
+                        for num in range(3)])
+        session.commit()
+        session.expunge_all()
+
+        a = A.get(1)
+        selects.count = 0
+        a.from_dict({'bs': [{'id': num, 'name': 'b',
+                             'cs': [{'id': num * 10 + sub, 'name': 'c'}
+                                    for sub in range(2)]}
+                            for num in range(3)]})
+        # one query for the rows of B and one for those of C, plus the
+        # loading of the collections being replaced
+        assert selects.count == 2 + 1 + 3
+        assert [c.name for b in a.bs for c in b.cs] == ['c'] * 6
@@ -143,3 +143,49 @@ class TestEvents(object):
         # we just check that setup does not trigger an exception
         setup_all(True)
 
+
+    def test_inherited_registry(self):
+        class CountingDescriptor(object):
+            accessed = 0
+
+            def __get__(self, instance, owner):
+                CountingDescriptor.accessed += 1
+                return self
+
+        class A(Entity):
+            name = Field(String(50))
+            d = CountingDescriptor()
+
+            @before_insert
+            def pre_insert(self):
+                self.name = 'pre_insert'
+
+            @before_update
+            def pre_update(self):
+                self.name = 'pre_update'
+
+        class B(A):
+            # overriding a method without the decorator removes the event
+            # from B's own registry
+            def pre_update(self):
+                pass
+
+        assert B._descriptor.marked_methods == ['pre_insert', 'pre_update']
+
+        metadata.bind = 'sqlite://'
+        setup_all(True)
+
+        # setup does not need to look at the other attributes
+        assert CountingDescriptor.accessed == 0
+
+        B(name='b1')
+        session.commit(); session.expunge_all()
+
+        b = B.query.one()
+        assert b.name == 'pre_insert'
+        b.name = 'b1 updated'
+        session.commit(); session.expunge_all()
+
+        # ... but B's mapper inherits the extension of A's mapper, which
+        # still calls A's method
+        assert B.query.one().name == 'pre_update'
@@ -0,0 +1,56 @@
+"""
+test releasing setup-time state
+"""
+
+import sys
+
+from elixir import *
+from elixir.statements import MUTATORS
+
+
+def setup():
+    metadata.bind = 'sqlite://'
+
+
+class TestFreeze(object):
+    def teardown(self):
+        cleanup_all(True)
+
+    def test_freeze(self):
+        class A(Entity):
+            using_options(tablename='a')
+            name = Field(String(30))
+            bs = OneToMany('B')
+
+        class B(Entity):
+            name = Field(String(30))
+            a = ManyToOne('A')
+
+        setup_all(True)
+        released = freeze()
+
+        assert not A._descriptor.builders
+        assert not A._descriptor.relationships
+        assert MUTATORS not in A.__dict__
+        if hasattr(sys, 'getsizeof'):
+            assert released['A'] > 0
+            assert released['B'] > 0
+
+        # the entities still work
+        A(name='a1', bs=[B(name='b1')])
+        session.commit()
+        session.expunge_all()
+
+        a = A.get_by(name='a1')
+        assert a.bs[0].name == 'b1'
+        assert a.to_dict(deep={'bs': {}})['bs'][0]['name'] == 'b1'
+
+    def test_setup_all(self):
+        class A(Entity):
+            name = Field(String(30))
+
+        setup_all(True, freeze=True)
+
+        assert not A._descriptor.builders
+        A(name='a1')
+        session.commit()
@@ -0,0 +1,68 @@
+"""
+test that importing elixir does not load the optional parts of the package
+"""
+
+import os
+import sys
+from subprocess import Popen, PIPE
+
+import elixir
+
+
+def imported_modules(statement):
+    '''
+    Return the names of the modules loaded after running `statement` in a
+    fresh interpreter.
+    '''
+    code = "import sys\n%s\nsys.stdout.write(' '.join(sys.modules.keys()))" \
+           % statement
+    env = os.environ.copy()
+    path = os.path.dirname(os.path.dirname(os.path.abspath(elixir.__file__)))
+    env['PYTHONPATH'] = os.pathsep.join([path, env.get('PYTHONPATH', '')])
+    process = Popen([sys.executable, '-c', code], stdout=PIPE, env=env)
+    output = process.communicate()[0]
+    assert process.returncode == 0
+    return output.split()
+
+
+def test_import():
+    modules = imported_modules("import elixir")
+    for name in ('sqlalchemy.ext.associationproxy', 'elixir.reflection',
+                 'elixir.scheduler', 'elixir.cache'):
+        assert name not in modules, name
+
+
+def test_lazy_import():
+    modules = imported_modules("import elixir")
+    for name in ('sqlalchemy', 'sqlalchemy.orm', 'elixir.entity',
+                 'elixir.fields', 'elixir.relationships', 'elixir.options'):
+        assert name not in modules, name
+
+    modules = imported_modules("import elixir\nelixir.Field")
+    assert 'elixir.fields' in modules
+    assert 'elixir.relationships' not in modules
+
+
+def test_lazy_names():
+    import sqlalchemy.types
+    namespace = {}
+    exec "from elixir import *" in namespace
+    for name in elixir.__all__:
+        assert name in namespace, name
+    assert namespace['Integer'] is sqlalchemy.types.Integer
+    assert namespace['session'] is elixir.session
+
+    try:
+        elixir.NotAType
+    except AttributeError:
+        pass
+    else:
+        assert False
+
+
+def test_model_import():
+    modules = imported_modules("from elixir import *\n"
+                               "class A(Entity):\n"
+                               "    name = Field(String(30))\n"
+                               "    b = ManyToOne('A')\n")
+    assert 'sqlalchemy.ext.associationproxy' not in modules
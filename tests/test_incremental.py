@@ -0,0 +1,127 @@
+"""
+test incremental setup of entities
+"""
+
+from elixir import *
+
+
+def setup():
+    metadata.bind = 'sqlite://'
+
+
+class TestIncrementalSetup(object):
+    def teardown(self):
+        cleanup_all(True)
+
+    def test_new_entities(self):
+        class A(Entity):
+            name = Field(String(30))
+
+        setup_all(True, incremental=True)
+        a_mapper = A.mapper
+
+        class B(Entity):
+            name = Field(String(30))
+            a = ManyToOne('A')
+
+        setup_all(True, incremental=True)
+
+        # A was not set up again
+        assert A.mapper is a_mapper
+        assert hasattr(B, '_setup_done')
+
+        B(name='b1', a=A(name='a1'))
+        session.commit()
+        session.expunge_all()
+
+        assert B.get_by(name='b1').a.name == 'a1'
+
+    def test_added_properties(self):
+        class A(Entity):
+            name = Field(String(30))
+
+        setup_all(incremental=True)
+
+        class B(Entity):
+            name = Field(String(30))
+            a = ManyToOne('A')
+
+        A.bs = OneToMany('B')
+        A.code = Field(String(10))
+
+        setup_all(incremental=True)
+        create_all()
+
+        assert 'code' in A.table.columns
+        assert A._descriptor.find_relationship('bs').inverse is \
+               B._descriptor.find_relationship('a')
+
+        A(name='a1', code='x', bs=[B(name='b1'), B(name='b2')])
+        session.commit()
+        session.expunge_all()
+
+        a = A.get_by(code='x')
+        assert sorted([b.name for b in a.bs]) == ['b1', 'b2']
+        assert B.get_by(name='b1').a is a
+
+    def test_registry(self):
+        from elixir.entity import setup_registry
+
+        class A(Entity):
+            name = Field(String(30))
+
+        assert A in setup_registry.changed
+
+        setup_all(incremental=True)
+
+        assert A not in setup_registry.changed
+        assert setup_registry.incremental
+
+        A.code = Field(String(10))
+        assert A in setup_registry.changed
+
+        cleanup_all()
+        assert not setup_registry.changed
+        assert not setup_registry.incremental
+
+    def test_added_property_needs_incremental(self):
+        class A(Entity):
+            name = Field(String(30))
+
+        setup_all()
+
+        try:
+            A.code = Field(String(10))
+        except Exception:
+            pass
+        else:
+            assert False, "Adding a property after setup_all did not fail"
+
+    def test_added_inverse(self):
+        class A(Entity):
+            name = Field(String(30))
+
+        class B(Entity):
+            name = Field(String(30))
+            a = ManyToOne('A')
+
+        setup_all(True, incremental=True)
+
+        a1 = A(name='a1')
+        B(name='b1', a=a1)
+        session.commit()
+        assert a1.to_dict() == {'id': 1, 'name': 'a1'}
+        session.expunge_all()
+
+        # both entities are finalized: the inverse of B.a is added to A
+        A.bs = OneToMany('B')
+        A.title = ColumnProperty(lambda c: c.name + '!')
+        setup_all(incremental=True)
+
+        assert A._descriptor.find_relationship('bs').inverse is \
+               B._descriptor.find_relationship('a')
+
+        a1 = A.get_by(name='a1')
+        assert [b.name for b in a1.bs] == ['b1']
+        # the cached serializer of A was dropped
+        assert a1.to_dict() == {'id': 1, 'name': 'a1', 'title': 'a1!'}
@@ -0,0 +1,77 @@
+"""
+test lazy setup of entities
+"""
+
+from elixir import *
+
+
+def setup():
+    metadata.bind = 'sqlite://'
+
+
+class TestLazySetup(object):
+    def teardown(self):
+        cleanup_all(True)
+
+    def test_closure(self):
+        class A(Entity):
+            name = Field(String(30))
+            bs = OneToMany('B')
+
+        class B(Entity):
+            name = Field(String(30))
+            a = ManyToOne('A')
+
+        class C(Entity):
+            name = Field(String(30))
+
+        setup_all(lazy=True)
+
+        assert not hasattr(A, '_setup_done')
+        assert not hasattr(B, '_setup_done')
+
+        assert 'name' in A.table.columns
+
+        assert hasattr(A, '_setup_done')
+        assert hasattr(B, '_setup_done')
+        assert not hasattr(C, '_setup_done')
+
+        create_all()
+
+        A(name='a1', bs=[B(name='b1')])
+        session.commit()
+        session.expunge_all()
+
+        assert A.get_by(name='a1').bs[0].name == 'b1'
+
+        # instantiation triggers the setup too
+        c = C(name='c1')
+        assert hasattr(C, '_setup_done')
+        C.table.create()
+        session.commit()
+
+        assert C.query.count() == 1
+
+    def test_inheritance(self):
+        class Person(Entity):
+            name = Field(String(30))
+
+        class Employee(Person):
+            salary = Field(Integer)
+
+        setup_all(lazy=True)
+
+        Employee.query
+        assert hasattr(Person, '_setup_done')
+        assert 'salary' in Person.table.columns
+
+    def test_create_tables(self):
+        class A(Entity):
+            name = Field(String(30))
+
+        try:
+            setup_all(True, lazy=True)
+        except Exception:
+            pass
+        else:
+            assert False, "tables were created in lazy mode"
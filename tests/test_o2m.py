@@ -228,6 +228,23 @@ class TestOneToMany(object):
         assert b.a.name == 'a1'
         assert b in a.bs
 
+    def test_ambiguous_inverse(self):
+        class A(Entity):
+            name = Field(String(60))
+            bs = OneToMany('B')
+
+        class B(Entity):
+            name = Field(String(60))
+            a1 = ManyToOne('A')
+            a2 = ManyToOne('A')
+
+        try:
+            setup_all()
+        except Exception, e:
+            assert 'Several relations match' in str(e)
+        else:
+            assert False, "ambiguous inverse relationships were accepted"
+
     def test_has_many_syntax(self):
         class Person(Entity):
             has_field('name', String(30))
@@ -96,3 +96,42 @@ class TestPackages(object):
             assert len(elixir.entities) == 5
         finally:
             elixir.entities = original_collection
+
+    def test_deferred_import(self):
+        class C(Entity):
+            name = Field(String(30))
+            a = ManyToOne('tests.a.A')
+
+        assert 'tests.a' not in sys.modules
+
+        setup_all(True)
+
+        # resolving the target imported its module, and the entities defined
+        # there (and in the modules they refer to) were set up too
+        assert 'a_id' in C.table.columns
+        assert 'tests.b' in sys.modules
+        assert hasattr(elixir.entities.resolve('tests.b.B'), '_setup_done')
+
+    def test_lazy_deferred_import(self):
+        class C(Entity):
+            name = Field(String(30))
+            a = ManyToOne('tests.a.A')
+
+        setup_all(lazy=True)
+
+        # the target is only resolved when C is set up
+        assert 'tests.a' not in sys.modules
+
+        assert 'a_id' in C.table.columns
+        assert 'tests.a' in sys.modules
+        A = elixir.entities.resolve('tests.a.A')
+        B = elixir.entities.resolve('tests.b.B')
+        assert hasattr(A, '_setup_done')
+        assert hasattr(B, '_setup_done')
+
+        create_all()
+        C(name='c1', a=A(name='a1', b=B(name='b1')))
+        session.commit()
+        session.expunge_all()
+
+        assert C.get_by(name='c1').a.b.name == 'b1'
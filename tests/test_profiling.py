@@ -0,0 +1,55 @@
+"""
+test profiling of the setup phase
+"""
+
+import sys
+
+from elixir import *
+
+
+def setup():
+    metadata.bind = 'sqlite://'
+
+
+class TestProfiling(object):
+    def teardown(self):
+        cleanup_all(True)
+
+    def test_report(self):
+        class A(Entity):
+            name = Field(String(30))
+            bs = OneToMany('B')
+
+        class B(Entity):
+            name = Field(String(30))
+            a = ManyToOne('A')
+
+        setup_all(True, profile=True)
+
+        report = setup_report()
+        assert 'A' in report.entities
+        assert 'B' in report.entities
+        assert 'setup_mapper' in report.phases
+        assert report.phases['setup_mapper']['calls'] == 2
+        assert 'ManyToOne' in report.builders
+        for stats in report.entities.values():
+            assert stats['self_time'] <= stats['time']
+            # allocations are only counted by default when it is cheap
+            if hasattr(sys, 'getallocatedblocks'):
+                assert stats['allocations'] is not None
+            else:
+                assert stats['allocations'] is None
+        assert 'setup_mapper' in report.summary()
+
+        # the profiler is not active outside of setup_all
+        from elixir import profiling
+        assert profiling.profiler is None
+
+    def test_count_allocations(self):
+        class A(Entity):
+            name = Field(String(30))
+
+        setup_all(True, profile='allocations')
+
+        report = setup_report()
+        assert report.entities['A']['allocations'] is not None
@@ -0,0 +1,82 @@
+"""
+test the dependency-graph setup scheduler
+"""
+
+from elixir import *
+from elixir.scheduler import SetupScheduler
+
+
+def setup():
+    metadata.bind = 'sqlite://'
+
+
+class TestScheduler(object):
+    def teardown(self):
+        cleanup_all(True)
+
+    def test_components(self):
+        class Person(Entity):
+            name = Field(String(30))
+            addresses = OneToMany('Address')
+
+        class Address(Entity):
+            street = Field(String(30))
+            person = ManyToOne('Person')
+            country = ManyToOne('Country')
+
+        class Country(Entity):
+            name = Field(String(30))
+
+        class Tag(Entity):
+            name = Field(String(30))
+
+        # only schedule the entities of this test, whatever other tests left
+        # in the global collection
+        scheduler = SetupScheduler([Person, Address, Country, Tag])
+        components = [sorted([e.__name__ for e in c])
+                      for c in scheduler.components]
+
+        # Country is needed by Address, which forms a cycle with Person
+        assert components.index(['Country']) < \
+               components.index(['Address', 'Person'])
+        assert ['Tag'] in components
+
+        # partial setup
+        scheduler.run([Address])
+        assert hasattr(Person, '_setup_done')
+        assert hasattr(Country, '_setup_done')
+        assert not hasattr(Tag, '_setup_done')
+
+        scheduler.run()
+        assert hasattr(Tag, '_setup_done')
+
+        # use fixed durations: the measured ones depend on the machine load
+        for num in scheduler.durations:
+            scheduler.durations[num] = 1.0
+        total, path = scheduler.critical_path()
+        assert total == 2.0
+        assert [Country] in path
+        assert 'critical path' in scheduler.report()
+
+        create_all()
+        Person(name='p1', addresses=[Address(street='s1',
+                                             country=Country(name='c1'))])
+        session.commit()
+        session.expunge_all()
+
+        assert Person.get_by(name='p1').addresses[0].country.name == 'c1'
+
+    def test_setup_all(self):
+        class Person(Entity):
+            name = Field(String(30))
+
+        class Employee(Person):
+            salary = Field(Integer)
+
+        setup_all(True, schedule=True)
+
+        Employee(name='e1', salary=10)
+        session.commit()
+        session.expunge_all()
+
+        assert Person.query.one().salary == 10
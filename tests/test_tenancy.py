@@ -0,0 +1,229 @@
+"""
+test the schema-per-tenant extension
+
+The search path mode is tested against the PostgreSQL database given in the
+ELIXIR_TEST_POSTGRES_URL environment variable (for example
+"postgresql://user@localhost/test"), if any.
+"""
+
+import os
+
+from nose.plugins.skip import SkipTest
+from sqlalchemy import create_engine
+
+from elixir import *
+from elixir.ext import tenancy
+from elixir.ext.tenancy import set_tenant, get_tenant, clear_tenant
+
+
+def setup():
+    metadata.bind = 'sqlite://'
+
+
+class StubPreparer(object):
+    def quote_identifier(self, name):
+        return '"%s"' % name
+
+
+class StubDialect(object):
+    identifier_preparer = StubPreparer()
+
+    def __init__(self, name):
+        self.name = name
+
+
+class StubTransaction(object):
+    def __init__(self, conn):
+        self.conn = conn
+
+    def commit(self):
+        self.conn.statements.append('COMMIT')
+
+    def rollback(self):
+        self.conn.statements.append('ROLLBACK')
+
+
+class StubConnection(object):
+    '''
+    A connection recording the statements executed on it, instead of sending
+    them to a database.
+    '''
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.dialect = engine.dialect
+        self.statements = []
+        self.closed = False
+
+    def begin(self):
+        return StubTransaction(self)
+
+    def execute(self, statement):
+        self.statements.append(statement)
+
+    def close(self):
+        self.closed = True
+
+
+class StubEngine(object):
+    def __init__(self, dialect_name):
+        self.dialect = StubDialect(dialect_name)
+        self.connections = []
+
+    def connect(self):
+        conn = StubConnection(self)
+        self.connections.append(conn)
+        return conn
+
+
+class TestTenancy(object):
+    def teardown(self):
+        clear_tenant(session)
+        cleanup_all(True)
+
+    def test_switch_tenant(self):
+        if not tenancy.SCHEMA_TRANSLATION:
+            # without schema translation, tenants are only supported on
+            # PostgreSQL (through the search path)
+            raise SkipTest("schema translation is not supported by this "
+                           "version of SQLAlchemy")
+
+        class Movie(Entity):
+            title = Field(Unicode(30))
+
+        setup_all()
+
+        for schema in ('tenant1', 'tenant2'):
+            metadata.bind.execute("ATTACH DATABASE ':memory:' AS %s"
+                                  % schema)
+            conn = tenancy.tenant_connection(metadata.bind, schema)
+            Movie.table.create(bind=conn)
+            conn.close()
+
+        set_tenant(session, 'tenant1')
+        assert get_tenant(session) == 'tenant1'
+        Movie(title=u'Alien')
+        session.commit()
+
+        movie = Movie.query.one()
+        assert get_tenant(movie) == 'tenant1'
+
+        set_tenant(session, 'tenant2')
+        assert Movie.query.count() == 0
+        Movie(title=u'Star Wars')
+        Movie(title=u'Blade Runner')
+        session.commit()
+
+        set_tenant(session, 'tenant1')
+        assert Movie.query.one().title == u'Alien'
+
+        # the mapper and table are shared by all tenants
+        assert Movie.table.schema is None
+
+        clear_tenant(session)
+        assert get_tenant(session) is None
+
+    def test_search_path(self):
+        schema_translation = tenancy.SCHEMA_TRANSLATION
+        tenancy.SCHEMA_TRANSLATION = False
+        try:
+            engine = StubEngine('postgresql')
+
+            set_tenant(session, 'tenant1', bind=engine)
+            assert get_tenant(session) == 'tenant1'
+            conn1 = engine.connections[0]
+            assert conn1.statements == ['SET search_path TO "tenant1", public',
+                                        'COMMIT']
+
+            # the engine is taken from the connection of the current tenant
+            set_tenant(session, 'tenant2')
+            assert get_tenant(session) == 'tenant2'
+            conn2 = engine.connections[1]
+            assert conn2.statements == ['SET search_path TO "tenant2", public',
+                                        'COMMIT']
+
+            # the search path of a connection is reset before it is returned
+            # to the pool
+            assert conn1.statements[2:] == ['RESET search_path', 'COMMIT']
+            assert conn1.closed
+
+            clear_tenant(session)
+            assert get_tenant(session) is None
+            assert conn2.statements[2:] == ['RESET search_path', 'COMMIT']
+            assert conn2.closed
+        finally:
+            tenancy.SCHEMA_TRANSLATION = schema_translation
+
+    def test_search_path_unsupported(self):
+        schema_translation = tenancy.SCHEMA_TRANSLATION
+        tenancy.SCHEMA_TRANSLATION = False
+        try:
+            engine = StubEngine('sqlite')
+            try:
+                tenancy.tenant_connection(engine, 'tenant1')
+            except Exception, e:
+                assert 'only supported on PostgreSQL' in str(e)
+            else:
+                assert False, "search path was set on a sqlite connection"
+            assert engine.connections[0].statements == []
+            assert engine.connections[0].closed
+        finally:
+            tenancy.SCHEMA_TRANSLATION = schema_translation
+
+    def test_search_path_postgres(self):
+        url = os.environ.get('ELIXIR_TEST_POSTGRES_URL')
+        if not url:
+            raise SkipTest("ELIXIR_TEST_POSTGRES_URL is not set")
+        try:
+            engine = create_engine(url)
+            engine.connect().close()
+        except Exception, e:
+            raise SkipTest("cannot connect to %s: %s" % (url, e))
+
+        schema_translation = tenancy.SCHEMA_TRANSLATION
+        tenancy.SCHEMA_TRANSLATION = False
+        metadata.bind = engine
+        try:
+            class Movie(Entity):
+                title = Field(Unicode(30))
+
+            setup_all()
+
+            for schema in ('elixir_tenant1', 'elixir_tenant2'):
+                engine.execute("DROP SCHEMA IF EXISTS %s CASCADE" % schema)
+                engine.execute("CREATE SCHEMA %s" % schema)
+                conn = tenancy.tenant_connection(engine, schema)
+                Movie.table.create(bind=conn)
+                conn.close()
+
+            set_tenant(session, 'elixir_tenant1', bind=engine)
+            Movie(title=u'Alien')
+            session.commit()
+
+            set_tenant(session, 'elixir_tenant2')
+            assert Movie.query.count() == 0
+            Movie(title=u'Star Wars')
+            session.commit()
+
+            # the search path is kept when the session is rolled back
+            session.rollback()
+            assert Movie.query.one().title == u'Star Wars'
+
+            set_tenant(session, 'elixir_tenant1')
+            assert Movie.query.one().title == u'Alien'
+            clear_tenant(session)
+
+            # the connections returned to the pool use the default search
+            # path again
+            conn = engine.connect()
+            path = conn.execute("SHOW search_path").scalar()
+            conn.close()
+            assert 'elixir_tenant' not in path
+        finally:
+            clear_tenant(session)
+            cleanup_all()
+            for schema in ('elixir_tenant1', 'elixir_tenant2'):
+                engine.execute("DROP SCHEMA IF EXISTS %s CASCADE" % schema)
+            engine.dispose()
+            tenancy.SCHEMA_TRANSLATION = schema_translation
+            metadata.bind = 'sqlite://'
@@ -0,0 +1,96 @@
+"""
+test set-based deletes and updates
+"""
+
+from elixir import *
+
+
+def setup():
+    metadata.bind = 'sqlite://'
+
+
+class TestWhere(object):
+    def teardown(self):
+        cleanup_all(True)
+
+    def test_delete_where(self):
+        class A(Entity):
+            name = Field(String(30))
+            value = Field(Integer)
+
+        setup_all(True)
+
+        a1 = A(name='a1', value=1)
+        a2 = A(name='a2', value=2)
+        a3 = A(name='a3', value=3)
+        session.commit()
+
+        assert A.delete_where(A.value >= 2) == 2
+        assert a2 not in session
+        assert a1 in session
+        session.commit()
+
+        assert [a.name for a in A.query.all()] == ['a1']
+
+    def test_update_where(self):
+        class A(Entity):
+            name = Field(String(30))
+            value = Field(Integer)
+
+        setup_all(True)
+
+        a1 = A(name='a1', value=1)
+        a2 = A(name='a2', value=2)
+        session.commit()
+
+        assert A.update_where(A.value > 1, {'name': 'big'}) == 1
+        assert a2.name == 'big'
+        assert a1.name == 'a1'
+
+    def test_single_inheritance(self):
+        class Person(Entity):
+            name = Field(String(30))
+            using_options(inheritance='single')
+
+        class Employee(Person):
+            salary = Field(Integer)
+            using_options(inheritance='single')
+
+        setup_all(True)
+
+        Person(name='p1')
+        Employee(name='e1', salary=10)
+        session.commit()
+        session.expunge_all()
+
+        assert Employee.delete_where(Person.name != None) == 1
+        session.commit()
+        assert [p.name for p in Person.query.all()] == ['p1']
+
+    def test_multi_inheritance(self):
+        class Person(Entity):
+            name = Field(String(30))
+            using_options(inheritance='multi')
+
+        class Employee(Person):
+            salary = Field(Integer)
+            using_options(inheritance='multi')
+
+        setup_all(True)
+
+        Person(name='p1')
+        e1 = Employee(name='e1', salary=10)
+        Employee(name='e2', salary=20)
+        session.commit()
+
+        assert Employee.update_where(Employee.salary < 15,
+                                     {'name': 'junior', 'salary': 15}) == 1
+        assert e1.name == 'junior'
+        assert e1.salary == 15
+
+        assert Employee.delete_where(Employee.salary >= 15) == 2
+        assert e1 not in session
+        session.commit()
+
+        assert [p.name for p in Person.query.all()] == ['p1']
+        assert Employee.table.select().execute().fetchall() == []